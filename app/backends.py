@@ -0,0 +1,22 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.exceptions import ValidationError
+
+from .profile_cache import profile_cache
+
+
+class CachedProfileBackend(ModelBackend):
+    # ModelBackend, который берет пользователя сессии из кэша профилей: пользователь приходит
+    # вместе с профилем, и request.user.profile не требует отдельного запроса
+
+    def get_user(self, user_id):
+        try:
+            user_id = get_user_model()._meta.pk.to_python(user_id)
+        except ValidationError:
+            return None
+        profile = profile_cache.get(user_id)
+        # Пользователь без профиля (например, созданный createsuperuser)
+        if profile is None:
+            return super().get_user(user_id)
+        user = profile.user
+        return user if self.user_can_authenticate(user) else None
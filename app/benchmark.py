@@ -0,0 +1,112 @@
+import math
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+
+def percentile(values, percent):
+    # Процентиль по методу ближайшего ранга, values должны быть отсортированы
+    if not values:
+        return 0.0
+    rank = max(math.ceil(percent / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+def summarize(latencies, elapsed, errors=0, queries=None):
+    # Сводка прогона: пропускная способность и задержки в миллисекундах.
+    # queries - QueryStats прогона, по нему добавляются SQL-запросы и их время на один запрос
+    latencies = sorted(latencies)
+    summary = {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': len(latencies) / max(elapsed, 1e-9),
+        'p50': percentile(latencies, 50) * 1000,
+        'p95': percentile(latencies, 95) * 1000,
+        'p99': percentile(latencies, 99) * 1000,
+        'max': (latencies[-1] if latencies else 0.0) * 1000,
+    }
+    if queries is not None:
+        summary['sql_queries'] = queries.count / max(len(latencies), 1)
+        summary['sql_ms'] = queries.time * 1000 / max(len(latencies), 1)
+    return summary
+
+
+def run_threads(worker, batches):
+    # Параллельный запуск worker(batch) в отдельном потоке на каждую порцию.
+    # Возвращает результаты worker и общее время выполнения
+    def run(batch):
+        try:
+            return worker(batch)
+        finally:
+            connection.close()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(len(batches)) as executor:
+        results = list(executor.map(run, batches))
+    return results, time.perf_counter() - started
+
+
+class QueryStats:
+    # Количество и суммарное время SQL-запросов во всех соединениях, открытых во время track(),
+    # в том числе в потоках тестового сервера
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.count += 1
+                self.time += elapsed
+
+    def _install(self, sender, connection, **kwargs):
+        # Объект соединения переиспользуется при переподключении, обертка ставится один раз
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+            self._connections.append(connection)
+
+    @contextmanager
+    def track(self):
+        # Обертка ставится на соединения, открытые во время track(), и снимается с них в конце:
+        # постоянные соединения (CONN_MAX_AGE) переживают прогон
+        connection_created.connect(self._install)
+        try:
+            yield self
+        finally:
+            connection_created.disconnect(self._install)
+            for wrapped in self._connections:
+                if self in wrapped.execute_wrappers:
+                    wrapped.execute_wrappers.remove(self)
+            self._connections = []
+
+
+@contextmanager
+def benchmark_database(ratio, seed=None):
+    # Временная файловая база с применёнными миграциями и тестовыми данными fill_db.
+    # Файл, а не база в памяти, нужен, чтобы потоки работали с общими данными и блокировками.
+    # Тестовое окружение разрешает хост testserver, с которым работают тестовые клиенты
+    setup_test_environment()
+    with tempfile.TemporaryDirectory() as directory:
+        connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            call_command('fill_db', ratio, seed=seed, verbosity=0, stdout=StringIO())
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
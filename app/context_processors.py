@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject
+
+from .models import Profile, Tag
+from .stamps import SIDEBAR_STAMP, touch_on_commit
+
+SIDEBAR_CACHE_KEY = 'sidebar'
+
+
+def get_sidebar_data():
+    # Данные боковой панели берутся из кэша и пересчитываются не чаще раза в SIDEBAR_CACHE_TIMEOUT
+    data = cache.get(SIDEBAR_CACHE_KEY)
+    if data is None:
+        data = {
+            'top_users': list(Profile.objects.get_top_users()),
+            'popular_tags': list(Tag.get_popular_tags()),
+        }
+        cache.set(SIDEBAR_CACHE_KEY, data, settings.SIDEBAR_CACHE_TIMEOUT)
+    return data
+
+
+def invalidate_sidebar():
+    cache.delete(SIDEBAR_CACHE_KEY)
+    # Боковая панель есть на всех страницах, поэтому меняются и их ETag
+    touch_on_commit(SIDEBAR_STAMP)
+
+
+def sidebar(request):
+    # Ленивые значения: кэш не запрашивается, если шаблон не выводит боковую панель
+    return {
+        'top_users': SimpleLazyObject(lambda: get_sidebar_data()['top_users']),
+        'popular_tags': SimpleLazyObject(lambda: get_sidebar_data()['popular_tags']),
+    }
+
+
+def fragment_cache(request):
+    return {'fragment_cache_timeout': settings.FRAGMENT_CACHE_TIMEOUT}
@@ -0,0 +1,76 @@
+import asyncio
+import itertools
+import threading
+from collections import OrderedDict, deque
+
+from django.conf import settings
+from django.db import transaction
+
+
+class QuestionEvents:
+    # Шина событий страниц вопросов в памяти процесса: голоса и новые ответы публикуются
+    # в канал вопроса, подписчики (SSE и long-poll) ждут событий с номером больше известного.
+    # Хранятся последние EVENTS_HISTORY событий EVENTS_QUESTIONS последних активных вопросов,
+    # поэтому переподключившийся клиент получает пропущенное. Каждый процесс сервера видит
+    # только свои события.
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self._last_id = 0
+        self._history = OrderedDict()
+        self._waiters = {}
+        self._lock = threading.Lock()
+
+    @property
+    def last_id(self):
+        return self._last_id
+
+    def publish(self, question_id, event_type, data):
+        with self._lock:
+            event_id = next(self._ids)
+            self._last_id = event_id
+            history = self._history.pop(question_id, None)
+            if history is None:
+                history = deque(maxlen=settings.EVENTS_HISTORY)
+            history.append((event_id, event_type, data))
+            self._history[question_id] = history
+            if len(self._history) > settings.EVENTS_QUESTIONS:
+                self._history.popitem(last=False)
+            waiters = list(self._waiters.get(question_id, ()))
+        # Подписчики могут ждать в разных циклах событий (ASGI или async_to_sync под WSGI)
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+        return event_id
+
+    def events_after(self, question_id, after_id):
+        with self._lock:
+            return [event for event in self._history.get(question_id, ()) if event[0] > after_id]
+
+    async def wait(self, question_id, after_id, timeout):
+        # События вопроса с номером больше after_id; если их нет - ожидание не дольше timeout секунд
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters.setdefault(question_id, set()).add(waiter)
+        try:
+            events = self.events_after(question_id, after_id)
+            if not events:
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), timeout)
+                except asyncio.TimeoutError:
+                    return []
+                events = self.events_after(question_id, after_id)
+            return events
+        finally:
+            with self._lock:
+                waiters = self._waiters[question_id]
+                waiters.discard(waiter)
+                if not waiters:
+                    del self._waiters[question_id]
+
+
+question_events = QuestionEvents()
+
+
+def publish_on_commit(question_id, event_type, data):
+    # Событие уходит подписчикам только после фиксации транзакции, откаченные изменения не публикуются
+    transaction.on_commit(lambda: question_events.publish(question_id, event_type, data))
@@ -1,6 +1,9 @@
 from django import forms
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.db import transaction
+from .context_processors import invalidate_sidebar
+from .events import publish_on_commit
 from .models import Question, Answer, Profile, Tag
 
 
@@ -82,6 +85,9 @@ class ProfileEditorForm(forms.ModelForm):
         profile = super().save(**kwargs)
         profile.avatar = self.cleaned_data.get('avatar')
         profile.save()
+        if 'avatar' in self.changed_data:
+            profile.update_thumbnails()
+            invalidate_sidebar()
 
         user = profile.user
         user.username = self.cleaned_data['nickname']
@@ -116,7 +122,8 @@ class QuestionForm(forms.ModelForm):
 
     def get_tags(self):
         tags_input = self.cleaned_data.get('tags')
-        tag_names = [tag.strip().lower() for tag in tags_input.split(',') if tag.strip()]
+        # Повторяющиеся теги убираются с сохранением порядка
+        tag_names = list(dict.fromkeys(tag.strip().lower() for tag in tags_input.split(',') if tag.strip()))
 
         if len(tag_names) > 3:
             raise forms.ValidationError('Максимальное количество тегов - 3.')
@@ -129,7 +136,7 @@ class QuestionForm(forms.ModelForm):
 
         try:
             tag_names = self.get_tags()
-            tags = [Tag.objects.get_or_create(name=tag)[0] for tag in tag_names]
+            tags = Tag.objects.get_or_create_by_names(tag_names)
         except forms.ValidationError as e:
             self.add_error('tags', e.message)
             return question_item
@@ -158,5 +165,8 @@ class AnswerForm(forms.ModelForm):
         answer_item.author = self.user.profile
         answer_item.question = self.item
         if commit:
-            answer_item.save()
+            with transaction.atomic():
+                # Счетчик ответов и оценку вопроса обновляет обработчик post_save
+                answer_item.save()
+                publish_on_commit(self.item.id, 'answer', {'id': answer_item.id})
         return answer_item
@@ -0,0 +1,195 @@
+import json
+import platform
+import random
+import secrets
+import string
+import time
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from http.cookies import SimpleCookie
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.testcases import LiveServerThread, _StaticFilesHandler
+from django.test.utils import modify_settings
+from django.urls import reverse
+
+from app.benchmark import QueryStats, benchmark_database, run_threads, summarize
+from app.models import Answer, Profile, Question, Tag
+
+
+def feed_request(name):
+    # Случайная страница ленты из первых десяти
+    return lambda rnd, data: ('GET', f'{reverse(name)}?page={rnd.randint(1, data["pages"])}', None)
+
+
+def tag_page_request(rnd, data):
+    return 'GET', reverse('tag_page', kwargs={'tag_name': rnd.choice(data['tags'])}), None
+
+
+def question_request(rnd, data):
+    return 'GET', reverse('question', kwargs={'question_id': rnd.choice(data['questions'])}), None
+
+
+def question_like_request(rnd, data):
+    return 'POST', reverse('question_like'), {'question_id': rnd.choice(data['questions']),
+                                              'like_type': rnd.choice(('like', 'dislike'))}
+
+
+def answer_like_request(rnd, data):
+    return 'POST', reverse('answer_like'), {'answer_id': rnd.choice(data['answers']),
+                                            'like_type': rnd.choice(('like', 'dislike'))}
+
+
+ENDPOINTS = {
+    'index': feed_request('index'),
+    'hottest': feed_request('hottest'),
+    'tag_page': tag_page_request,
+    'question': question_request,
+    'question_like': question_like_request,
+    'answer_like': answer_like_request,
+}
+
+
+class HttpClient:
+    # Клиент настоящего HTTP-сервера с сессией пользователя, созданной тестовым клиентом
+    def __init__(self, base_url, user):
+        client = Client()
+        client.force_login(user)
+        # Для проверки CSRF достаточно совпадения cookie и заголовка с секретом из 32 символов
+        csrf_token = ''.join(secrets.choice(string.ascii_letters + string.digits) for _ in range(32))
+        cookies = SimpleCookie()
+        cookies[settings.SESSION_COOKIE_NAME] = client.cookies[settings.SESSION_COOKIE_NAME].value
+        cookies[settings.CSRF_COOKIE_NAME] = csrf_token
+        self.base_url = base_url
+        self.headers = {'Cookie': cookies.output(header='', sep=';').strip(), 'X-CSRFToken': csrf_token}
+
+    def request(self, method, path, data):
+        body = urlencode(data).encode() if data is not None else None
+        headers = dict(self.headers)
+        if body is not None:
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        try:
+            with urlopen(Request(self.base_url + path, body, headers, method=method)) as response:
+                response.read()
+                return response.status
+        except HTTPError as error:
+            return error.code
+
+
+class TestClient:
+    def __init__(self, user):
+        self.client = Client(raise_request_exception=False)
+        self.client.force_login(user)
+
+    def request(self, method, path, data):
+        if method == 'POST':
+            return self.client.post(path, data).status_code
+        return self.client.get(path).status_code
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный тест основных страниц и голосования на временной базе с данными fill_db: '
+            'пропускная способность, задержки и SQL-запросы по каждому адресу')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ratio', type=int, default=100, help='Размер тестовых данных для fill_db')
+        parser.add_argument('--seed', type=int, default=0, help='Зерно генератора данных и запросов')
+        parser.add_argument('--requests', type=int, default=200, help='Количество запросов к каждому адресу')
+        parser.add_argument('--concurrency', type=int, default=4, help='Количество параллельных клиентов')
+        parser.add_argument('--endpoints', nargs='+', choices=list(ENDPOINTS), default=list(ENDPOINTS),
+                            help='Проверяемые адреса')
+        parser.add_argument('--transport', choices=['client', 'http'], default='client',
+                            help='client - тестовый клиент Django, http - локальный многопоточный HTTP-сервер')
+        parser.add_argument('--json', metavar='PATH',
+                            help='Сохранить результаты в JSON для сравнения версий ("-" - вывод в stdout)')
+
+    def handle(self, *args, **options):
+        concurrency = options['concurrency']
+        if options['requests'] < 1 or concurrency < 1:
+            raise CommandError('--requests и --concurrency должны быть положительными')
+        if options['ratio'] < concurrency:
+            raise CommandError('ratio должен быть не меньше --concurrency: у каждого клиента свой пользователь')
+
+        self.started_at = datetime.now(timezone.utc)
+        with benchmark_database(options['ratio'], options['seed']):
+            data = {
+                'questions': list(Question.objects.values_list('id', flat=True)),
+                'answers': list(Answer.objects.values_list('id', flat=True)),
+                'tags': list(Tag.objects.values_list('name', flat=True)),
+                'pages': min(10, max(Question.objects.count() // 15, 1)),
+            }
+            users = [profile.user for profile in Profile.objects.select_related('user').order_by('id')[:concurrency]]
+
+            with ExitStack() as stack:
+                if options['transport'] == 'http':
+                    base_url = self.start_server(stack)
+                    clients = [HttpClient(base_url, user) for user in users]
+                else:
+                    clients = [TestClient(user) for user in users]
+                results = {name: self.run_endpoint(name, clients, data, options) for name in options['endpoints']}
+
+        self.report(results, options)
+
+    @staticmethod
+    def start_server(stack):
+        # Многопоточный сервер LiveServerTestCase поверх временной базы, останавливается при выходе из stack
+        stack.enter_context(modify_settings(ALLOWED_HOSTS={'append': 'localhost'}))
+        server = LiveServerThread('localhost', _StaticFilesHandler)
+        server.daemon = True
+        server.start()
+        stack.callback(server.terminate)
+        server.is_ready.wait()
+        if server.error:
+            raise server.error
+        return f'http://localhost:{server.port}'
+
+    def run_endpoint(self, name, clients, data, options):
+        rnd = random.Random(f'{options["seed"]}:{name}')
+        requests = [ENDPOINTS[name](rnd, data) for _ in range(options['requests'])]
+        # Каждый клиент выполняет свою часть запросов от имени своего пользователя
+        batches = [(client, requests[i::len(clients)]) for i, client in enumerate(clients)]
+
+        def worker(batch):
+            client, client_requests = batch
+            latencies, errors = [], 0
+            for method, path, body in client_requests:
+                started = time.perf_counter()
+                status = client.request(method, path, body)
+                latencies.append(time.perf_counter() - started)
+                errors += status != 200
+            return latencies, errors
+
+        queries = QueryStats()
+        with queries.track():
+            runs, elapsed = run_threads(worker, batches)
+        latencies = [latency for run_latencies, _ in runs for latency in run_latencies]
+        return summarize(latencies, elapsed, sum(errors for _, errors in runs), queries)
+
+    def report(self, results, options):
+        if options['json']:
+            report = {
+                'started_at': self.started_at.isoformat(),
+                'django': django.get_version(),
+                'python': platform.python_version(),
+                'options': {key: options[key] for key in ('ratio', 'seed', 'requests', 'concurrency', 'transport')},
+                'endpoints': results,
+            }
+            if options['json'] == '-':
+                self.stdout.write(json.dumps(report, indent=2, ensure_ascii=False))
+                return
+            with open(options['json'], 'w') as file:
+                json.dump(report, file, indent=2, ensure_ascii=False)
+
+        self.stdout.write(f'{"адрес":<15}{"запросы":>9}{"ошибки":>8}{"rps":>9}{"p50, мс":>10}{"p95, мс":>10}'
+                          f'{"p99, мс":>10}{"SQL/запр":>10}{"SQL, мс":>9}')
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:<15}{result["requests"]:>9}{result["errors"]:>8}{result["rps"]:>9.0f}{result["p50"]:>10.1f}'
+                f'{result["p95"]:>10.1f}{result["p99"]:>10.1f}{result["sql_queries"]:>10.1f}{result["sql_ms"]:>9.2f}'
+            )
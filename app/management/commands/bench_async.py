@@ -0,0 +1,106 @@
+import asyncio
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client
+from django.urls import reverse
+
+from app.benchmark import benchmark_database, run_threads, summarize
+from app.models import Answer, Profile, Question
+
+
+def vote_requests(rnd, count):
+    # Случайная последовательность голосов и отметок правильного ответа
+    question_ids = list(Question.objects.values_list('id', flat=True))
+    answers = list(Answer.objects.values_list('id', 'question__author_id'))
+    requests = []
+    for _ in range(count):
+        kind = rnd.random()
+        if kind < 0.45:
+            requests.append((reverse('question_like'), {'question_id': rnd.choice(question_ids),
+                                                        'like_type': rnd.choice(('like', 'dislike'))}))
+        elif kind < 0.9:
+            requests.append((reverse('answer_like'), {'answer_id': rnd.choice(answers)[0],
+                                                      'like_type': rnd.choice(('like', 'dislike'))}))
+        else:
+            requests.append((reverse('make_correct'), {'answer_id': rnd.choice(answers)[0]}))
+    return requests
+
+
+class Command(BaseCommand):
+    help = 'Сравнение синхронных (WSGI) и асинхронных (ASGI) обработчиков голосования при параллельных клиентах'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000, help='Количество запросов в каждом режиме')
+        parser.add_argument('--concurrency', type=int, default=16, help='Количество параллельных клиентов')
+        parser.add_argument('--ratio', type=int, default=20, help='Размер тестовых данных для fill_db')
+        parser.add_argument('--seed', type=int, default=0, help='Зерно генератора случайных чисел')
+
+    def handle(self, *args, **options):
+        concurrency = options['concurrency']
+        if options['requests'] < 1 or concurrency < 1:
+            raise CommandError('--requests и --concurrency должны быть положительными')
+        if options['ratio'] < concurrency:
+            raise CommandError('ratio должен быть не меньше --concurrency: у каждого клиента свой пользователь')
+
+        with benchmark_database(options['ratio'], options['seed']):
+            users = [profile.user for profile in Profile.objects.select_related('user').order_by('id')[:concurrency]]
+            requests = vote_requests(random.Random(options['seed']), options['requests'])
+            # Каждый клиент выполняет свою часть запросов от имени своего пользователя
+            batches = [requests[i::concurrency] for i in range(concurrency)]
+
+            results = [('WSGI', self.run_wsgi(users, batches)), ('ASGI', self.run_asgi(users, batches))]
+
+        self.stdout.write(f'{"режим":<6}{"запросы":>9}{"ошибки":>8}{"rps":>9}'
+                          f'{"p50, мс":>10}{"p95, мс":>10}{"p99, мс":>10}{"max, мс":>10}')
+        for mode, result in results:
+            self.stdout.write(
+                f'{mode:<6}{result["requests"]:>9}{result["errors"]:>8}{result["rps"]:>9.0f}'
+                f'{result["p50"]:>10.1f}{result["p95"]:>10.1f}{result["p99"]:>10.1f}{result["max"]:>10.1f}'
+            )
+
+    def run_wsgi(self, users, batches):
+        def worker(args):
+            user, batch = args
+            client = Client(raise_request_exception=False)
+            client.force_login(user)
+            latencies, errors = [], 0
+            for path, data in batch:
+                started = time.perf_counter()
+                response = client.post(path, data)
+                latencies.append(time.perf_counter() - started)
+                errors += response.status_code != 200
+            return latencies, errors
+
+        runs, elapsed = run_threads(worker, list(zip(users, batches)))
+        return self.collect(runs, elapsed)
+
+    def run_asgi(self, users, batches):
+        clients = []
+        for user in users:
+            client = AsyncClient(raise_request_exception=False)
+            # В Django 4.2 у AsyncClient нет асинхронного входа, сессия создаётся до запуска цикла событий
+            client.force_login(user)
+            clients.append(client)
+
+        async def worker(client, batch):
+            latencies, errors = [], 0
+            for path, data in batch:
+                started = time.perf_counter()
+                response = await client.post(path, data)
+                latencies.append(time.perf_counter() - started)
+                errors += response.status_code != 200
+            return latencies, errors
+
+        async def run():
+            return await asyncio.gather(*[worker(client, batch) for client, batch in zip(clients, batches)])
+
+        started = time.perf_counter()
+        runs = asyncio.run(run())
+        return self.collect(runs, time.perf_counter() - started)
+
+    @staticmethod
+    def collect(runs, elapsed):
+        latencies = [latency for run_latencies, _ in runs for latency in run_latencies]
+        return summarize(latencies, elapsed, sum(errors for _, errors in runs))
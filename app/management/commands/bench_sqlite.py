@@ -0,0 +1,112 @@
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from app.benchmark import benchmark_database, run_threads, summarize
+from app.management.commands.bench import ENDPOINTS, TestClient
+from app.models import Answer, Profile, Question, Tag
+
+# Режимы соединений SQLite: значения по умолчанию самой SQLite (журнал отката, полная синхронизация,
+# соединение на каждый запрос) и настройки проекта (SQLITE_PRAGMAS и CONN_MAX_AGE из DATABASES)
+MODES = {
+    'default': lambda: ({'journal_mode': 'DELETE', 'synchronous': 'FULL'}, 0),
+    'tuned': lambda: (settings.SQLITE_PRAGMAS, settings.DATABASES['default'].get('CONN_MAX_AGE', 0)),
+}
+
+READ_ENDPOINTS = ['index', 'hottest', 'tag_page', 'question']
+
+
+class Command(BaseCommand):
+    help = ('Пропускная способность чтения страниц во время потока голосов question_like '
+            'при настройках SQLite по умолчанию и с SQLITE_PRAGMAS')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ratio', type=int, default=100, help='Размер тестовых данных для fill_db')
+        parser.add_argument('--seed', type=int, default=0, help='Зерно генератора данных и запросов')
+        parser.add_argument('--seconds', type=float, default=5, help='Длительность прогона каждого режима')
+        parser.add_argument('--readers', type=int, default=4, help='Количество читающих клиентов')
+        parser.add_argument('--writers', type=int, default=2, help='Количество голосующих клиентов')
+        parser.add_argument('--read-endpoints', nargs='+', choices=READ_ENDPOINTS, default=['index', 'question'],
+                            help='Адреса, которые запрашивают читающие клиенты')
+        parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES),
+                            help='Сравниваемые режимы')
+
+    def handle(self, *args, **options):
+        if options['readers'] < 1 or options['writers'] < 0 or options['seconds'] <= 0:
+            raise CommandError('Нужен хотя бы один читающий клиент и положительная длительность')
+        clients_count = options['readers'] + options['writers']
+        if options['ratio'] < clients_count:
+            raise CommandError('ratio должен быть не меньше числа клиентов: у каждого клиента свой пользователь')
+
+        results = {}
+        with benchmark_database(options['ratio'], options['seed']):
+            data = {
+                'questions': list(Question.objects.values_list('id', flat=True)),
+                'answers': list(Answer.objects.values_list('id', flat=True)),
+                'tags': list(Tag.objects.values_list('name', flat=True)),
+                'pages': min(10, max(Question.objects.count() // 15, 1)),
+            }
+            users = [profile.user for profile in Profile.objects.select_related('user').order_by('id')[:clients_count]]
+            for mode in options['modes']:
+                results[mode] = self.run_mode(mode, users, data, options)
+
+        self.report(results)
+
+    def run_mode(self, mode, users, data, options):
+        pragmas, conn_max_age = MODES[mode]()
+        conn_max_age_before = connection.settings_dict['CONN_MAX_AGE']
+        # Режим журнала хранится в файле базы, поэтому каждый режим задает его явно; новые соединения
+        # потоков открываются уже с настройками режима
+        connection.close()
+        connection.settings_dict['CONN_MAX_AGE'] = conn_max_age
+        try:
+            with override_settings(SQLITE_PRAGMAS=pragmas):
+                connection.ensure_connection()
+                clients = [TestClient(user) for user in users]
+                roles = ['read'] * options['readers'] + ['write'] * options['writers']
+                deadline = time.perf_counter() + options['seconds']
+                batches = [(role, client, random.Random(f'{options["seed"]}:{mode}:{i}'), deadline)
+                           for i, (role, client) in enumerate(zip(roles, clients))]
+                runs, elapsed = run_threads(lambda batch: self.worker(batch, data, options), batches)
+        finally:
+            connection.close()
+            connection.settings_dict['CONN_MAX_AGE'] = conn_max_age_before
+
+        summaries = {}
+        for role in ('read', 'write'):
+            role_runs = [(latencies, errors) for run_role, latencies, errors in runs if run_role == role]
+            if role_runs:
+                latencies = [latency for run_latencies, _ in role_runs for latency in run_latencies]
+                summaries[role] = summarize(latencies, elapsed, sum(errors for _, errors in role_runs))
+        return summaries
+
+    @staticmethod
+    def worker(batch, data, options):
+        # Клиент отправляет запросы один за другим до окончания прогона
+        role, client, rnd, deadline = batch
+        latencies, errors = [], 0
+        while time.perf_counter() < deadline:
+            name = rnd.choice(options['read_endpoints']) if role == 'read' else 'question_like'
+            method, path, body = ENDPOINTS[name](rnd, data)
+            started = time.perf_counter()
+            status = client.request(method, path, body)
+            latencies.append(time.perf_counter() - started)
+            errors += status != 200
+        return role, latencies, errors
+
+    def report(self, results):
+        self.stdout.write(f'{"режим":<10}{"клиенты":<9}{"запросы":>9}{"ошибки":>8}{"rps":>9}{"p50, мс":>10}'
+                          f'{"p95, мс":>10}{"p99, мс":>10}{"макс, мс":>10}')
+        for mode, summaries in results.items():
+            for role, result in summaries.items():
+                self.stdout.write(
+                    f'{mode:<10}{role:<9}{result["requests"]:>9}{result["errors"]:>8}{result["rps"]:>9.0f}'
+                    f'{result["p50"]:>10.1f}{result["p95"]:>10.1f}{result["p99"]:>10.1f}{result["max"]:>10.1f}'
+                )
+        if 'default' in results and 'tuned' in results:
+            speedup = results['tuned']['read']['rps'] / max(results['default']['read']['rps'], 1e-9)
+            self.stdout.write(f'Чтение с SQLITE_PRAGMAS: x{speedup:.2f} к настройкам по умолчанию')
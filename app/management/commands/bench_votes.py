@@ -0,0 +1,90 @@
+import random
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Q
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from app.benchmark import benchmark_database, run_threads, summarize
+from app.management.commands.bench import TestClient
+from app.models import Profile, Question
+from app.vote_buffer import vote_buffer
+
+MODES = ['direct', 'write-behind']
+
+
+class Command(BaseCommand):
+    help = ('Устойчивая скорость голосования question_like за несколько популярных вопросов '
+            'с записью каждого голоса сразу и через буфер отложенной записи')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ratio', type=int, default=50, help='Размер тестовых данных для fill_db')
+        parser.add_argument('--seed', type=int, default=0, help='Зерно генератора данных и запросов')
+        parser.add_argument('--seconds', type=float, default=5, help='Длительность прогона каждого режима')
+        parser.add_argument('--concurrency', type=int, default=8, help='Количество голосующих клиентов')
+        parser.add_argument('--hot', type=int, default=3, help='Количество вопросов, за которые голосуют')
+        parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES, help='Сравниваемые режимы')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['hot'] < 1 or options['seconds'] <= 0:
+            raise CommandError('--concurrency, --hot и --seconds должны быть положительными')
+        if options['ratio'] < options['concurrency']:
+            raise CommandError('ratio должен быть не меньше --concurrency: у каждого клиента свой пользователь')
+
+        results = {}
+        with benchmark_database(options['ratio'], options['seed']), tempfile.TemporaryDirectory() as journal:
+            users = [profile.user for profile in
+                     Profile.objects.select_related('user').order_by('id')[:options['concurrency']]]
+            questions = list(Question.objects.order_by('id').values_list('id', flat=True)[:options['hot']])
+            for mode in options['modes']:
+                with override_settings(VOTE_WRITE_BEHIND=mode == 'write-behind', VOTE_BUFFER_JOURNAL=journal):
+                    results[mode] = self.run_mode(mode, users, questions, options)
+
+        self.stdout.write(f'{"режим":<14}{"голоса":>8}{"ошибки":>8}{"голос/с":>9}{"p50, мс":>10}'
+                          f'{"p99, мс":>10}{"макс, мс":>10}{"запись, мс":>12}{"расхожд.":>10}')
+        for mode, result in results.items():
+            self.stdout.write(
+                f'{mode:<14}{result["requests"]:>8}{result["errors"]:>8}{result["rps"]:>9.0f}{result["p50"]:>10.1f}'
+                f'{result["p99"]:>10.1f}{result["max"]:>10.1f}{result["drain_ms"]:>12.1f}{result["drifted"]:>10}'
+            )
+
+    def run_mode(self, mode, users, questions, options):
+        clients = [TestClient(user) for user in users]
+        deadline = time.perf_counter() + options['seconds']
+        batches = [(client, random.Random(f'{options["seed"]}:{mode}:{i}')) for i, client in enumerate(clients)]
+        path = reverse('question_like')
+
+        def worker(batch):
+            client, rnd = batch
+            latencies, errors = [], 0
+            while time.perf_counter() < deadline:
+                data = {'question_id': rnd.choice(questions), 'like_type': rnd.choice(('like', 'dislike'))}
+                started = time.perf_counter()
+                status = client.request('POST', path, data)
+                latencies.append(time.perf_counter() - started)
+                errors += status != 200
+            return latencies, errors
+
+        runs, elapsed = run_threads(worker, batches)
+        # Время записи голосов, оставшихся в буфере после окончания прогона
+        started = time.perf_counter()
+        vote_buffer.stop()
+        drain_time = time.perf_counter() - started
+
+        result = summarize([latency for latencies, _ in runs for latency in latencies], elapsed,
+                           sum(errors for _, errors in runs))
+        result['drain_ms'] = drain_time * 1000
+        result['drifted'] = self.drifted(questions)
+        return result
+
+    @staticmethod
+    def drifted(questions):
+        # Количество вопросов, счетчики которых после записи не совпадают с голосами
+        counted = Question.objects.filter(id__in=questions).annotate(
+            actual_likes=Count('vote', filter=Q(vote__value=1)),
+            actual_dislikes=Count('vote', filter=Q(vote__value=-1)),
+        )
+        return sum(question.likes != question.actual_likes or question.dislikes != question.actual_dislikes
+                   for question in counted)
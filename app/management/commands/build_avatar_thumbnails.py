@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app.context_processors import invalidate_sidebar
+from app.models import Profile
+from app.thumbnails import generate_thumbnails, thumbnails_exist
+
+# Аватары тестовых данных fill_db и аватар по умолчанию
+SEED_AVATARS = [f'img/{i}.png' for i in range(1, 11)] + ['img/default.png']
+
+
+class Command(BaseCommand):
+    help = 'Создание миниатюр для загруженных аватаров и аватаров тестовых данных'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Пересоздать уже существующие миниатюры')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        # Один файл аватара может быть у многих пользователей, миниатюры создаются по разу на файл
+        names = set(SEED_AVATARS) | set(Profile.objects.exclude(avatar='').values_list('avatar', flat=True).distinct())
+        created = failed = 0
+        for name in sorted(names):
+            if not options['force'] and thumbnails_exist(name):
+                ready = True
+            else:
+                ready = generate_thumbnails(name)
+                created += ready
+                failed += not ready
+                if not ready and options['verbosity'] >= 1:
+                    self.stderr.write(f'Не удалось прочитать изображение {name}')
+            Profile.objects.filter(avatar=name).update(has_thumbnails=ready)
+        invalidate_sidebar()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Миниатюры созданы для {created} аватаров из {len(names)}, ошибок: {failed}, '
+            f'за {time.monotonic() - started:.1f} с'
+        ))
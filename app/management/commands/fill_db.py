@@ -1,7 +1,18 @@
-from django.core.management.base import BaseCommand
+import random
+import time
+from collections import Counter, namedtuple
+from datetime import datetime, timezone
+from multiprocessing import Pool
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+from app.context_processors import invalidate_sidebar
 from app.models import Profile, Question, Answer, Tag, Vote
+from app.ranking import hot_score
+from app.search import get_search_backend
+from app.thumbnails import thumbnails_exist
 from django.contrib.auth.models import User
-import random
 
 content_examples = [
     "Текст очень интересного вопроса, ответ на который я хочу получить!!!!",
@@ -18,56 +29,195 @@ answer_examples = [
     "Изучение питона лучше всего начать с похода в зоопарк, не так ли? Или я сам не в теме?",
 ]
 
+QUESTIONS_PER_USER = 10
+ANSWERS_PER_QUESTION = 10
+# Доля вопросов без ответов
+UNANSWERED_SHARE = 0.2
+TAGS_PER_QUESTION = 3
+VOTES_PER_ITEM = 3
+# Вопросы равномерно распределяются по времени создания за этот период
+QUESTIONS_PERIOD_SECONDS = 365 * 24 * 60 * 60
+
+# Первые идентификаторы и количество строк, относительно которых генерируются ссылки
+Layout = namedtuple('Layout', ['ratio', 'first_profile', 'first_tag', 'first_question', 'first_answer', 'seed',
+                               'now'])
+
+
+def random_votes(rnd, layout):
+    # Голоса разных пользователей, чтобы не нарушить уникальность голоса
+    profiles = rnd.sample(range(layout.first_profile, layout.first_profile + layout.ratio), VOTES_PER_ITEM)
+    return [(profile_id, rnd.choice((Vote.LIKE, Vote.DISLIKE))) for profile_id in profiles]
+
+
+def generate_questions(layout, start, stop):
+    # Генерация вопросов с номерами [start, stop) вместе с тегами, ответами и голосами.
+    # Функция не обращается к базе и может выполняться в отдельном процессе.
+    rnd = random.Random(None if layout.seed is None else f'{layout.seed}:{start}')
+    rows = {'questions': [], 'question_tags': [], 'answers': [], 'votes': []}
+
+    # Ответы порции (в среднем ANSWERS_PER_QUESTION на вопрос) распределяются случайно между вопросами,
+    # у которых они есть; идентификаторы ответов порции идут подряд
+    answered = [i for i in range(start, stop) if rnd.random() >= UNANSWERED_SHARE] or [start]
+    answer_questions = sorted(rnd.choice(answered) for _ in range((stop - start) * ANSWERS_PER_QUESTION))
+    answer_counts = Counter(answer_questions)
+
+    for i in range(start, stop):
+        question_id = layout.first_question + i
+        question_votes = random_votes(rnd, layout)
+        rows['votes'].extend((profile_id, value, question_id, None) for profile_id, value in question_votes)
+        rows['questions'].append((
+            question_id, f'Question-{question_id - 1}', rnd.choice(content_examples), answer_counts[i],
+            rnd.randint(layout.first_profile, layout.first_profile + layout.ratio - 1),
+            [value for _, value in question_votes],
+            layout.now - rnd.uniform(0, QUESTIONS_PERIOD_SECONDS),
+        ))
+
+        tag_ids = set(rnd.randint(layout.first_tag, layout.first_tag + layout.ratio - 1)
+                      for _ in range(TAGS_PER_QUESTION))
+        rows['question_tags'].extend((question_id, tag_id) for tag_id in tag_ids)
+
+    for j, i in enumerate(answer_questions):
+        answer_id = layout.first_answer + start * ANSWERS_PER_QUESTION + j
+        answer_votes = random_votes(rnd, layout)
+        rows['votes'].extend((profile_id, value, None, answer_id) for profile_id, value in answer_votes)
+        rows['answers'].append((
+            answer_id, rnd.choice(answer_examples), bool(rnd.getrandbits(1)), layout.first_question + i,
+            rnd.randint(layout.first_profile, layout.first_profile + layout.ratio - 1),
+            [value for _, value in answer_votes],
+        ))
+    return rows
+
+
+def generate_questions_chunk(args):
+    return generate_questions(*args)
+
+
+def rating_fields(values):
+    likes = values.count(Vote.LIKE)
+    return {'likes': likes, 'dislikes': len(values) - likes, 'rating': sum(values)}
+
+
+def question_object(question_id, title, content, answer_count, author_id, values, created_at):
+    ratings = rating_fields(values)
+    created_at = datetime.fromtimestamp(created_at, timezone.utc)
+    return Question(id=question_id, title=title, content=content, answer_count=answer_count, author_id=author_id,
+                    created_at=created_at, hot_score=hot_score(ratings['rating'], answer_count, created_at),
+                    **ratings)
+
+
+def next_id(model):
+    return (model.objects.aggregate(last_id=Max('id'))['last_id'] or 0) + 1
+
 
 class Command(BaseCommand):
+    help = 'Заполнение базы тестовыми данными с помощью bulk_create'
 
     def add_arguments(self, parser):
         parser.add_argument('ratio', type=int, help='Ratio for data generation (recommended:10000)')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Количество строк в одном INSERT и вопросов в одной транзакции')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Количество процессов, генерирующих вопросы, ответы и голоса')
+        parser.add_argument('--seed', type=int, default=None, help='Зерно генератора случайных чисел')
 
     def handle(self, *args, **options):
         ratio = options['ratio']
+        batch_size = options['batch_size']
+        workers = options['workers']
+        if ratio < VOTES_PER_ITEM:
+            raise CommandError(f'ratio должен быть не меньше {VOTES_PER_ITEM}')
+        if batch_size < 1 or workers < 1:
+            raise CommandError('--batch-size и --workers должны быть положительными')
 
-        # Создание пользователя
-        for i in range(ratio):
-            print(f'user-{str(i)}')
-            user = User.objects.create(username=f'user-{str(i)}')
-            Profile.objects.create(user=user, nickname=f'nickname-{str(i)}',
-                                   avatar=f'img/{random.randint(1, 10)}.png')
+        self.batch_size = batch_size
+        self.verbosity = options['verbosity']
+        # Количество вставленных строк и время вставки по таблицам
+        self.stats = {}
+        # Количество правильных ответов по авторам - рейтинг пользователей
+        self.correct_answers = Counter()
+        started = time.monotonic()
+
+        layout = Layout(ratio=ratio, first_profile=next_id(Profile), first_tag=next_id(Tag),
+                        first_question=next_id(Question), first_answer=next_id(Answer), seed=options['seed'],
+                        now=time.time())
+        rnd = random.Random(layout.seed)
+        first_user = next_id(User)
+
+        # Создание пользователей, номера в именах продолжаются при повторном запуске.
+        # Миниатюры общих аватаров создает команда build_avatar_thumbnails
+        avatars = [f'img/{i}.png' for i in range(1, 11)]
+        has_thumbnails = {avatar: thumbnails_exist(avatar) for avatar in avatars}
+        with transaction.atomic():
+            self.insert(User, [User(id=first_user + i, username=f'user-{first_user + i - 1}') for i in range(ratio)])
+            profiles = []
+            for i in range(ratio):
+                avatar = rnd.choice(avatars)
+                profiles.append(Profile(id=layout.first_profile + i, user_id=first_user + i,
+                                        nickname=f'nickname-{layout.first_profile + i - 1}',
+                                        avatar=avatar, has_thumbnails=has_thumbnails[avatar]))
+            self.insert(Profile, profiles)
 
         # Создание тегов
-        for i in range(ratio):
-            print(f'tag-{str(i)}')
-            Tag.objects.create(name=f'tag-{str(i)}')
-
-        # Создание вопросов и ответов
-        for i in range(ratio * 10):
-            print(f'Question-{str(i)}')
-            author = Profile.objects.get(id=random.randint(1, ratio))
-            question = Question.objects.create(title=f'Question-{str(i)}',
-                                               content=random.choice(content_examples),
-                                               answer_count=random.randint(0, 10), author=author)
-            tag_nums = set()
-
-            max_tags = 3
-            for _ in range(max_tags):
-                tag_nums.add(random.randint(1, ratio))
-            tag_nums = list(tag_nums)
-
-            for j in range(len(tag_nums)):
-                question.tags.add(Tag.objects.get(id=tag_nums[j]))
-
-            for _ in range(10):
-                author = Profile.objects.get(id=random.randint(1, ratio))
-                answer = Answer.objects.create(content=random.choice(answer_examples), correct=bool(random.getrandbits(1)),
-                                      question=question, author=author)
-                # Лайки ответа
-                for j in range(3):
-                    Vote.objects.create(profile=Profile.objects.get(id=random.randint(1, ratio)),
-                                        vote_type=random.choice(['like', 'dislike']),
-                                        answer=answer)
-
-            # Лайки вопроса
-            for j in range(3):
-                Vote.objects.create(profile=Profile.objects.get(id=random.randint(1, ratio)),
-                                    vote_type=random.choice(['like', 'dislike']),
-                                    question=question)
+        with transaction.atomic():
+            self.insert(Tag, [Tag(id=layout.first_tag + i, name=f'tag-{layout.first_tag + i - 1}') for i in range(ratio)])
+
+        # Создание вопросов и ответов порциями по batch_size вопросов
+        questions_count = ratio * QUESTIONS_PER_USER
+        chunks = [(layout, start, min(start + batch_size, questions_count))
+                  for start in range(0, questions_count, batch_size)]
+        if workers > 1:
+            with Pool(workers) as pool:
+                for rows in pool.imap(generate_questions_chunk, chunks):
+                    self.insert_questions(rows)
+        else:
+            for chunk in chunks:
+                self.insert_questions(generate_questions_chunk(chunk))
+        with transaction.atomic():
+            profiles = [Profile(id=profile_id, rating=rating) for profile_id, rating in self.correct_answers.items()]
+            Profile.objects.bulk_update(profiles, ['rating'], batch_size=self.batch_size)
+        # bulk_create не отправляет сигналы, поэтому кэш боковой панели сбрасывается явно
+        invalidate_sidebar()
+
+        elapsed = time.monotonic() - started
+        if self.verbosity >= 1:
+            for label, (rows, insert_time) in self.stats.items():
+                self.stdout.write(f'{label}: {rows} строк, {rows / max(insert_time, 1e-6):.0f} строк/с при вставке')
+        total_rows = sum(rows for rows, _ in self.stats.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано {total_rows} строк за {elapsed:.1f} с ({total_rows / max(elapsed, 1e-6):.0f} строк/с)'
+        ))
+
+    def insert_questions(self, rows):
+        tags_through = Question.tags.through
+        search_backend = get_search_backend()
+        with transaction.atomic():
+            questions = [
+                question_object(question_id, title, content, answer_count, author_id, values, created_at)
+                for question_id, title, content, answer_count, author_id, values, created_at in rows['questions']
+            ]
+            self.insert(Question, questions)
+            search_backend.index_questions(questions)
+            self.insert(tags_through, [
+                tags_through(question_id=question_id, tag_id=tag_id)
+                for question_id, tag_id in rows['question_tags']
+            ])
+            answers = [
+                Answer(id=answer_id, content=content, correct=correct, question_id=question_id,
+                       author_id=author_id, **rating_fields(values))
+                for answer_id, content, correct, question_id, author_id, values in rows['answers']
+            ]
+            self.insert(Answer, answers)
+            self.correct_answers.update(answer.author_id for answer in answers if answer.correct)
+            search_backend.index_answers(answers)
+            self.insert(Vote, [
+                Vote(profile_id=profile_id, value=value, question_id=question_id, answer_id=answer_id)
+                for profile_id, value, question_id, answer_id in rows['votes']
+            ])
+        if self.verbosity >= 2:
+            self.stdout.write(f'Вопросы: {rows["questions"][-1][1]}')
+
+    def insert(self, model, objects):
+        started = time.monotonic()
+        model.objects.bulk_create(objects, batch_size=self.batch_size)
+        rows, elapsed = self.stats.get(model._meta.label, (0, 0.0))
+        self.stats[model._meta.label] = (rows + len(objects), elapsed + time.monotonic() - started)
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from app.models import RequestStat
+from app.performance import request_stats
+
+
+class Command(BaseCommand):
+    help = 'Накопленные PerformanceMiddleware показатели запросов по именам адресов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Обнулить счетчики после вывода')
+
+    def handle(self, *args, **options):
+        # Счетчики этого процесса (например, после call_command в оболочке) сохраняются перед выводом
+        request_stats.flush()
+
+        self.stdout.write(f'{"адрес":<28}{"запросы":>9}{"медл.":>7}{"сред, мс":>10}{"макс, мс":>10}'
+                          f'{"вид, мс":>9}{"SQL/запр":>10}{"SQL, мс":>9}{"шабл, мс":>10}')
+        for stat in RequestStat.objects.order_by('-total_time'):
+            count = max(stat.requests, 1)
+            self.stdout.write(
+                f'{stat.url_name:<28}{stat.requests:>9}{stat.slow_requests:>7}'
+                f'{stat.total_time * 1000 / count:>10.1f}{stat.max_time * 1000:>10.1f}'
+                f'{stat.view_time * 1000 / count:>9.1f}{stat.sql_queries / count:>10.1f}'
+                f'{stat.sql_time * 1000 / count:>9.1f}{stat.template_time * 1000 / count:>10.1f}'
+            )
+
+        if options['reset']:
+            deleted, _ = RequestStat.objects.all().delete()
+            self.stdout.write(self.style.SUCCESS(f'Удалено {deleted} строк счетчиков'))
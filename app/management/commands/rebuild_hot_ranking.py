@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app.models import Question
+from app.ranking import rebuild_hot_scores
+
+
+class Command(BaseCommand):
+    help = 'Полный пересчет оценок горячих вопросов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Количество вопросов в одной транзакции')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        updated = rebuild_hot_scores(Question, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано {updated} вопросов за {time.monotonic() - started:.1f} с'
+        ))
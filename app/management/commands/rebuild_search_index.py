@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Полная перестройка поискового индекса вопросов и ответов'
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        indexed = get_search_backend().rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Проиндексировано {indexed} записей за {time.monotonic() - started:.1f} с'
+        ))
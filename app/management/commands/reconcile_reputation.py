@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from app.context_processors import invalidate_sidebar
+from app.models import Profile
+
+
+class Command(BaseCommand):
+    help = 'Исправление рейтинга пользователей, разошедшегося с количеством правильных ответов'
+
+    def handle(self, *args, **options):
+        fixed = Profile.objects.reconcile_ratings()
+        if fixed:
+            invalidate_sidebar()
+        self.stdout.write(self.style.SUCCESS(f'Исправлен рейтинг {fixed} пользователей'))
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from app.vote_buffer import replay_journal
+
+
+class Command(BaseCommand):
+    help = ('Запись голосов из журнала буфера отложенной записи, оставшихся после завершения процессов сервера. '
+            'Журналы работающих процессов не затрагиваются')
+
+    def handle(self, *args, **options):
+        if not settings.VOTE_BUFFER_JOURNAL:
+            raise CommandError('VOTE_BUFFER_JOURNAL не задан')
+        replayed = replay_journal()
+        self.stdout.write(self.style.SUCCESS(f'Воспроизведено операций: {replayed}'))
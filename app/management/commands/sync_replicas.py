@@ -0,0 +1,34 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from app.sqlite import copy_database
+
+
+class Command(BaseCommand):
+    help = ('Копирование основной базы SQLite в реплики DATABASE_REPLICAS для локальной проверки '
+            'маршрутизации чтения. Реплики других СУБД синхронизируются средствами самой СУБД')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+                            help='Повторять копирование с этим интервалом в секундах до прерывания')
+
+    def handle(self, *args, **options):
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas:
+            raise CommandError('DATABASE_REPLICAS пуст')
+        primary = connections[DEFAULT_DB_ALIAS]
+        for alias in [DEFAULT_DB_ALIAS, *replicas]:
+            if connections[alias].vendor != 'sqlite':
+                raise CommandError(f'База {alias} не SQLite')
+
+        while True:
+            started = time.perf_counter()
+            for alias in replicas:
+                copy_database(primary, connections[alias])
+            self.stdout.write(f'Скопировано в {", ".join(replicas)} за {(time.perf_counter() - started) * 1000:.0f} мс')
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,61 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:56
+
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_ratings(apps, schema_editor):
+    # Перенос существующих голосов в хранимые счетчики
+    Vote = apps.get_model('app', 'Vote')
+    for model_name, field in (('Question', 'question'), ('Answer', 'answer')):
+        model = apps.get_model('app', model_name)
+
+        def votes_count(vote_type):
+            votes = Vote.objects.filter(**{field: OuterRef('pk'), 'vote_type': vote_type})
+            votes = votes.order_by().values(field).annotate(count=Count('id')).values('count')
+            return Coalesce(Subquery(votes), 0)
+
+        model.objects.update(likes=votes_count('like'), dislikes=votes_count('dislike'))
+        model.objects.update(rating=F('likes') - F('dislikes'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_alter_vote_unique_together'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answer',
+            name='dislikes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='answer',
+            name='likes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='answer',
+            name='rating',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='dislikes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='likes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='rating',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_ratings, migrations.RunPython.noop),
+    ]
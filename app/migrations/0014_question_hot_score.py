@@ -0,0 +1,35 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:02
+
+from django.db import migrations, models
+import django.utils.timezone
+
+from app.ranking import rebuild_hot_scores
+
+
+def fill_hot_scores(apps, schema_editor):
+    rebuild_hot_scores(apps.get_model('app', 'Question'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_question_rating_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='hot_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['-hot_score', '-id'], name='question_hot_score_idx'),
+        ),
+        migrations.RunPython(fill_hot_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations
+
+SEARCH_TABLE = 'app_search_index'
+
+
+def create_search_index(apps, schema_editor):
+    # Полнотекстовый индекс FTS5 есть только у SQLite, для остальных баз используется поиск через LIKE
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        f'CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5('
+        f"title, content, question_id UNINDEXED, tokenize = 'unicode61 remove_diacritics 2')"
+    )
+    # Ранжирование по bm25, совпадение в заголовке весит в 10 раз больше совпадения в тексте
+    schema_editor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rank) VALUES ('rank', 'bm25(10.0, 1.0)')")
+    schema_editor.execute(
+        f'INSERT INTO {SEARCH_TABLE} (rowid, title, content, question_id) '
+        f'SELECT id * 2, title, content, id FROM app_question'
+    )
+    schema_editor.execute(
+        f'INSERT INTO {SEARCH_TABLE} (rowid, title, content, question_id) '
+        f"SELECT id * 2 + 1, '', content, question_id FROM app_answer"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0014_question_hot_score'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
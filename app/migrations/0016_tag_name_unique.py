@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:04
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_tags(apps, schema_editor):
+    # Перед добавлением уникальности вопросы переносятся на тег с наименьшим id, дубликаты удаляются
+    Tag = apps.get_model('app', 'Tag')
+    QuestionTags = apps.get_model('app', 'Question').tags.through
+    duplicates = Tag.objects.values('name').annotate(count=Count('id'), keep_id=Min('id')).filter(count__gt=1)
+    for duplicate in duplicates:
+        extra_ids = list(Tag.objects.filter(name=duplicate['name']).exclude(id=duplicate['keep_id'])
+                         .values_list('id', flat=True))
+        tagged = set(QuestionTags.objects.filter(tag_id=duplicate['keep_id']).values_list('question_id', flat=True))
+        for link in QuestionTags.objects.filter(tag_id__in=extra_ids):
+            if link.question_id not in tagged:
+                QuestionTags.objects.create(question_id=link.question_id, tag_id=duplicate['keep_id'])
+                tagged.add(link.question_id)
+        Tag.objects.filter(id__in=extra_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0015_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_tags, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='tag',
+            name='name',
+            field=models.CharField(max_length=30, unique=True),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:05
+
+from django.db import migrations, models
+from django.db.models import Count, F, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def remove_duplicate_votes(apps, schema_editor):
+    # Старое ограничение допускало лайк и дизлайк одного пользователя за один объект:
+    # оставляем последний голос и пересчитываем счетчики затронутых объектов
+    Vote = apps.get_model('app', 'Vote')
+    for model_name, field in (('Question', 'question'), ('Answer', 'answer')):
+        duplicates = (Vote.objects.filter(**{f'{field}__isnull': False}).values('profile', field)
+                      .annotate(count=Count('id'), keep_id=Max('id')).filter(count__gt=1))
+        affected = set()
+        for duplicate in duplicates:
+            Vote.objects.filter(profile=duplicate['profile'], **{field: duplicate[field]}) \
+                .exclude(id=duplicate['keep_id']).delete()
+            affected.add(duplicate[field])
+        if not affected:
+            continue
+
+        def votes_count(vote_type):
+            votes = Vote.objects.filter(**{field: OuterRef('pk'), 'vote_type': vote_type})
+            votes = votes.order_by().values(field).annotate(count=Count('id')).values('count')
+            return Coalesce(Subquery(votes), 0)
+
+        model = apps.get_model('app', model_name)
+        items = model.objects.filter(id__in=affected)
+        items.update(likes=votes_count('like'), dislikes=votes_count('dislike'))
+        items.update(rating=F('likes') - F('dislikes'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0016_tag_name_unique'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_votes, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='vote',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='vote',
+            constraint=models.UniqueConstraint(fields=('profile', 'question'), name='unique_question_vote'),
+        ),
+        migrations.AddConstraint(
+            model_name='vote',
+            constraint=models.UniqueConstraint(fields=('profile', 'answer'), name='unique_answer_vote'),
+        ),
+    ]
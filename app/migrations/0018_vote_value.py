@@ -0,0 +1,46 @@
+from django.db import migrations, models
+
+
+def fill_vote_values(apps, schema_editor):
+    Vote = apps.get_model('app', 'Vote')
+    Vote.objects.filter(vote_type='dislike').update(value=-1)
+
+
+def fill_vote_types(apps, schema_editor):
+    Vote = apps.get_model('app', 'Vote')
+    Vote.objects.filter(value=1).update(vote_type='like')
+    Vote.objects.filter(value=-1).update(vote_type='dislike')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0017_vote_unique_target'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vote',
+            name='value',
+            field=models.SmallIntegerField(choices=[(1, 'Like'), (-1, 'Dislike')], default=1),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='vote',
+            name='vote_type',
+            field=models.CharField(choices=[('like', 'Like'), ('dislike', 'Dislike')], default='like', max_length=7),
+        ),
+        migrations.RunPython(fill_vote_values, fill_vote_types),
+        migrations.RemoveField(
+            model_name='vote',
+            name='vote_type',
+        ),
+        migrations.RemoveField(
+            model_name='answer',
+            name='votes',
+        ),
+        migrations.RemoveField(
+            model_name='question',
+            name='votes',
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:10
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_profile_ratings(apps, schema_editor):
+    Answer = apps.get_model('app', 'Answer')
+    Profile = apps.get_model('app', 'Profile')
+    correct_answers = Answer.objects.filter(author=OuterRef('pk'), correct=True).order_by().values('author')
+    correct_answers = correct_answers.annotate(count=Count('id')).values('count')
+    Profile.objects.update(rating=Coalesce(Subquery(correct_answers), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0018_vote_value'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='rating',
+            field=models.IntegerField(db_index=True, default=0),
+        ),
+        migrations.RunPython(fill_profile_ratings, migrations.RunPython.noop),
+    ]
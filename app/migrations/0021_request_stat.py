@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0020_rated_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url_name', models.CharField(max_length=255, unique=True)),
+                ('requests', models.PositiveBigIntegerField(default=0)),
+                ('slow_requests', models.PositiveBigIntegerField(default=0)),
+                ('total_time', models.FloatField(default=0)),
+                ('max_time', models.FloatField(default=0)),
+                ('view_time', models.FloatField(default=0)),
+                ('sql_queries', models.PositiveBigIntegerField(default=0)),
+                ('sql_time', models.FloatField(default=0)),
+                ('template_time', models.FloatField(default=0)),
+            ],
+        ),
+    ]
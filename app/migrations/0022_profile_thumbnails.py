@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0021_request_stat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='has_thumbnails',
+            field=models.BooleanField(default=False),
+        ),
+    ]
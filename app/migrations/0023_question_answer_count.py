@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:26
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def recount_answers(apps, schema_editor):
+    # Раньше счетчик не обновлялся при ответах, а fill_db заполнял его случайными числами
+    Answer = apps.get_model('app', 'Answer')
+    Question = apps.get_model('app', 'Question')
+    answers = Answer.objects.filter(question=OuterRef('pk')).order_by().values('question')
+    answers = answers.annotate(count=Count('id')).values('count')
+    Question.objects.update(answer_count=Coalesce(Subquery(answers), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0022_profile_thumbnails'),
+    ]
+
+    operations = [
+        migrations.RunPython(recount_answers, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['answer_count', '-id'], name='question_answer_count_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:05
+
+from django.db import migrations
+
+
+def reset_thumbnails(apps, schema_editor):
+    # Миниатюры переименованы (расширение оригинала теперь входит в имя), файлов со старыми
+    # именами аватары больше не находят. Новые создает команда build_avatar_thumbnails
+    Profile = apps.get_model('app', 'Profile')
+    Profile.objects.filter(has_thumbnails=True).update(has_thumbnails=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0023_question_answer_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(reset_thumbnails, migrations.RunPython.noop),
+    ]
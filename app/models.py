@@ -1,37 +1,78 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.paginator import Paginator
-from django.db.models import Count, Sum
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .ranking import hot_score
+from .tag_index import tag_index
+from .thumbnails import generate_thumbnails, thumbnail_urls
 
 
 class ProfileManager(models.Manager):
     def get_top_users(self, count=5):
-        # Получение пятерки самых лучших пользователей
-        return self.get_queryset().annotate(
-            total_rating=Sum(models.Case(
-                models.When(answer__correct=True, then=1),
-                default=0,
-                output_field=models.IntegerField()
-            ))
-        ).order_by('-total_rating')[:count]
+        # Получение пятерки самых лучших пользователей по индексу хранимого рейтинга
+        return self.get_queryset().order_by('-rating', 'id')[:count]
+
+    def reconcile_ratings(self):
+        # Пересчет рейтинга по количеству правильных ответов для профилей, где хранимое значение разошлось
+        correct_answers = Answer.objects.filter(author=OuterRef('pk'), correct=True).order_by().values('author')
+        correct_answers = correct_answers.annotate(count=Count('id')).values('count')
+        drifted = self.get_queryset().annotate(actual=Coalesce(Subquery(correct_answers), 0)) \
+            .exclude(rating=F('actual')).values_list('id', 'actual')
+        fixed = 0
+        for profile_id, actual in drifted.iterator():
+            fixed += self.filter(pk=profile_id).update(rating=actual)
+        return fixed
 
 
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     nickname = models.CharField(max_length=30)
     avatar = models.ImageField(upload_to='img/avatars', default='img/default.png')
+    # Для аватара созданы миниатюры (app.thumbnails)
+    has_thumbnails = models.BooleanField(default=False)
+    # Количество правильных ответов пользователя
+    rating = models.IntegerField(default=0, db_index=True)
     objects = ProfileManager()
 
     def __str__(self):
         return str(self.nickname)
 
     def get_user_rating(self):
-        return Answer.objects.filter(author=self, correct=True).count()
+        return self.rating
+
+    @property
+    def avatar_thumbnails(self):
+        # Адреса миниатюр аватара или None, если их еще нет и выводится оригинал
+        return thumbnail_urls(self.avatar.name) if self.has_thumbnails else None
+
+    def update_thumbnails(self):
+        # Создание миниатюр после загрузки аватара
+        self.has_thumbnails = generate_thumbnails(self.avatar.name)
+        Profile.objects.filter(pk=self.pk).update(has_thumbnails=self.has_thumbnails)
+
+
+class TagManager(models.Manager):
+    def get_or_create_by_names(self, names):
+        # Получение тегов по списку имен: одна выборка существующих и один bulk_create для новых
+        tags = {tag.name: tag for tag in self.filter(name__in=names)}
+        missing = [name for name in names if name not in tags]
+        if missing:
+            # ignore_conflicts на случай одновременного создания того же тега другим запросом
+            self.bulk_create([Tag(name=name) for name in missing], ignore_conflicts=True)
+            tags.update((tag.name, tag) for tag in self.filter(name__in=missing))
+            # Откаченные теги не должны попасть в автодополнение
+            transaction.on_commit(lambda: tag_index.add(missing))
+        return [tags[name] for name in names]
 
 
 # Модель тега
 class Tag(models.Model):
-    name = models.CharField(max_length=30)
+    name = models.CharField(max_length=30, unique=True)
+    objects = TagManager()
 
     def __str__(self):
         return str(self.name)
@@ -43,50 +84,136 @@ class Tag(models.Model):
 
 
 class Vote(models.Model):
+    LIKE = 1
+    DISLIKE = -1
     VOTE_CHOICES = [
-        ('like', 'Like'),
-        ('dislike', 'Dislike'),
+        (LIKE, 'Like'),
+        (DISLIKE, 'Dislike'),
     ]
+    # Значение голоса по типу, который присылает клиент
+    VOTE_VALUES = {
+        'like': LIKE,
+        'dislike': DISLIKE,
+    }
+    # Счетчик оцениваемой модели, соответствующий значению голоса
+    COUNTER_FIELDS = {
+        LIKE: 'likes',
+        DISLIKE: 'dislikes',
+    }
     profile = models.ForeignKey(Profile, on_delete=models.CASCADE)
-    vote_type = models.CharField(max_length=7, choices=VOTE_CHOICES)
+    # Рейтинг объекта - сумма значений его голосов
+    value = models.SmallIntegerField(choices=VOTE_CHOICES)
     question = models.ForeignKey('Question', on_delete=models.CASCADE, null=True, blank=True)
     answer = models.ForeignKey('Answer', on_delete=models.CASCADE, null=True, blank=True)
 
     class Meta:
-        unique_together = ['profile', 'vote_type', 'question', 'answer']
+        # Один голос пользователя на вопрос или ответ; NULL в question/answer не конфликтуют между собой
+        constraints = [
+            models.UniqueConstraint(fields=['profile', 'question'], name='unique_question_vote'),
+            models.UniqueConstraint(fields=['profile', 'answer'], name='unique_answer_vote'),
+        ]
+
+    @staticmethod
+    def counters_delta(old_value, new_value):
+        # Изменение счетчиков лайков и дизлайков при смене голоса old_value -> new_value
+        delta = {'likes': 0, 'dislikes': 0}
+        if old_value:
+            delta[Vote.COUNTER_FIELDS[old_value]] -= 1
+        if new_value:
+            delta[Vote.COUNTER_FIELDS[new_value]] += 1
+        return delta
+
+
+# Абстрактная модель с хранимым рейтингом
+class RatedModel(models.Model):
+    rating = models.IntegerField(default=0)
+    likes = models.PositiveIntegerField(default=0)
+    dislikes = models.PositiveIntegerField(default=0)
+    # Версия для ключа кэша отрисованной карточки: увеличивается при любом изменении, видимом в карточке
+    version = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            super().save(*args, **kwargs)
+            return
+        # Версия не записывается из объекта, а увеличивается в базе: иначе сохранение затерло бы увеличения
+        # от параллельных голосов и карточка могла бы получить версию, под которой в кэше старый HTML
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            update_fields = [field.name for field in self._meta.concrete_fields if not field.primary_key]
+        kwargs['update_fields'] = [name for name in update_fields if name != 'version']
+        super().save(*args, **kwargs)
+        self.bump_version()
+        self.refresh_from_db(fields=['version'])
+
+    def bump_version(self):
+        type(self).objects.filter(pk=self.pk).update(version=F('version') + 1)
+
+    def get_total_rating(self):
+        # Получение общей оценки из хранимого счетчика
+        return self.rating
+
+    def update_rating(self, likes=0, dislikes=0):
+        # Атомарное изменение счетчиков с помощью F-выражений
+        type(self).objects.filter(pk=self.pk).update(
+            likes=F('likes') + likes,
+            dislikes=F('dislikes') + dislikes,
+            rating=F('rating') + likes - dislikes,
+            version=F('version') + 1,
+        )
+        self.refresh_from_db(fields=['rating', 'likes', 'dislikes', 'version'])
 
 
 # Модель ответа на вопрос
-class Answer(models.Model):
+class Answer(RatedModel):
     content = models.TextField()
     correct = models.BooleanField(default=False)
     question = models.ForeignKey('Question', on_delete=models.CASCADE)
     author = models.ForeignKey(Profile, on_delete=models.CASCADE)
-    votes = models.ManyToManyField(Vote, related_name='answer_votes')
 
-    def get_total_rating(self):
-        # Получение общей оценки ответа
-        return (Vote.objects.filter(answer=self, vote_type='like').count() -
-                Vote.objects.filter(answer=self, vote_type='dislike').count())
+    def toggle_correct(self):
+        # Переключение отметки правильного ответа и рейтинга автора в одной транзакции.
+        # UPDATE с условием на старое значение не даст двум одновременным запросам изменить рейтинг дважды.
+        with transaction.atomic():
+            flipped = Answer.objects.filter(pk=self.pk, correct=self.correct).update(correct=not self.correct,
+                                                                                     version=F('version') + 1)
+            if flipped:
+                self.correct = not self.correct
+                Profile.objects.filter(pk=self.author_id).update(rating=F('rating') + (1 if self.correct else -1))
+            else:
+                self.refresh_from_db(fields=['correct'])
+        return bool(flipped)
 
 
 # Менеджер модели вопроса
 class QuestionManager(models.Manager):
+    def list_questions(self):
+        # Вопросы для вывода списком: автор подтягивается JOIN-ом, теги - одним дополнительным запросом,
+        # рейтинг хранится в самой таблице вопросов
+        return self.get_queryset().select_related('author').prefetch_related('tags')
+
     def best_questions(self):
-        # Получение лучших вопросов с использованием аннотации и сортировки
-        questions_items = self.get_queryset().annotate(
-            total_rating=Sum(models.Case(
-                models.When(vote__vote_type='like', then=1),
-                models.When(vote__vote_type='dislike', then=-1),
-                default=0,
-                output_field=models.IntegerField(),
-            ))
-        ).order_by('-total_rating')
-        return questions_items
+        # Получение лучших вопросов по хранимому рейтингу
+        return self.list_questions().order_by('-rating', '-id')
 
     def new_questions(self):
         # Получение новых вопросов с сортировкой по убыванию ID
-        return self.get_queryset().order_by('-id')
+        return self.list_questions().order_by('-id')
+
+    def hot_questions(self):
+        # Получение горячих вопросов по предварительно рассчитанной оценке
+        return self.list_questions().order_by('-hot_score', '-id')
+
+    def unanswered_questions(self):
+        # Получение новых вопросов без ответов
+        return self.new_questions().filter(answer_count=0)
+
+    def tagged_questions(self, tag):
+        # Получение новых вопросов с указанным тегом
+        return self.new_questions().filter(tags=tag)
 
     def sort_questions(self):
         # Сортировка вопросов по убыванию ID
@@ -94,29 +221,71 @@ class QuestionManager(models.Manager):
 
 
 # Модель вопроса
-class Question(models.Model):
+class Question(RatedModel):
     title = models.CharField(max_length=100)
     content = models.TextField()
     answer_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    hot_score = models.FloatField(default=0)
     tags = models.ManyToManyField(Tag)
     author = models.ForeignKey(Profile, on_delete=models.CASCADE)
-    votes = models.ManyToManyField(Vote, related_name='question_votes')
     objects = QuestionManager()
 
+    class Meta:
+        indexes = [
+            # Индекс для ленты лучших вопросов и курсорной пагинации по (rating, id)
+            models.Index(fields=['-rating', '-id'], name='question_rating_idx'),
+            # Индекс для ленты горячих вопросов
+            models.Index(fields=['-hot_score', '-id'], name='question_hot_score_idx'),
+            # Индекс для ленты вопросов без ответов (answer_count = 0, по убыванию id)
+            models.Index(fields=['answer_count', '-id'], name='question_answer_count_idx'),
+        ]
+
     def __str__(self):
         return str(self.title)
 
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            self.hot_score = hot_score(self.rating, 0, self.created_at)
+        super().save(*args, **kwargs)
+
+    def update_hot_score(self):
+        # Пересчет оценки после нового голоса или ответа
+        self.hot_score = hot_score(self.rating, self.answer_count, self.created_at)
+        Question.objects.filter(pk=self.pk).update(hot_score=self.hot_score)
+
+    def change_answer_count(self, delta):
+        # Изменение счетчика ответов одним UPDATE вместе с версией карточки, в которой он выводится
+        Question.objects.filter(pk=self.pk).update(answer_count=F('answer_count') + delta, version=F('version') + 1)
+        self.refresh_from_db(fields=['answer_count', 'version'])
+
+    def get_answers(self):
+        # Ответы на вопрос вместе с авторами для вывода списком
+        return self.answer_set.select_related('author').order_by('id')
+
     def get_absolute_url(self):
         # Получение абсолютного URL для вопроса
         return f'/question/{self.id}'
 
-    def get_total_rating(self):
-        # Получение общей оценки вопроса
-        return (Vote.objects.filter(question=self, vote_type='like').count() -
-                Vote.objects.filter(question=self, vote_type='dislike').count())
-
     @staticmethod
     def paginate_questions(objects, page, per_page=15):
         # Пагинация вопросов с использованием Django Paginator
         paginator = Paginator(objects, per_page)
         return paginator.get_page(page)
+
+
+class RequestStat(models.Model):
+    # Накопленные показатели производительности запросов по имени адреса (PerformanceMiddleware).
+    # Время хранится в секундах
+    url_name = models.CharField(max_length=255, unique=True)
+    requests = models.PositiveBigIntegerField(default=0)
+    slow_requests = models.PositiveBigIntegerField(default=0)
+    total_time = models.FloatField(default=0)
+    max_time = models.FloatField(default=0)
+    view_time = models.FloatField(default=0)
+    sql_queries = models.PositiveBigIntegerField(default=0)
+    sql_time = models.FloatField(default=0)
+    template_time = models.FloatField(default=0)
+
+    def __str__(self):
+        return self.url_name
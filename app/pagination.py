@@ -0,0 +1,80 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.db.models import Q
+
+from .models import Question
+
+
+def encode_cursor(values):
+    # Непрозрачный токен ?after= со значениями ключей последнего объекта страницы
+    data = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def decode_cursor(token, keys_count):
+    # Некорректный токен считается отсутствующим, как и неверный номер страницы в Paginator.get_page
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (ValueError, binascii.Error):
+        return None
+    if not isinstance(values, list) or len(values) != keys_count:
+        return None
+    if not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+        return None
+    return values
+
+
+def keyset_filter(keys, values):
+    # Условие "строго после курсора" для сортировки по убыванию всех ключей:
+    # (k1 < v1) OR (k1 = v1 AND k2 < v2) OR ...
+    condition = Q()
+    for i, key in enumerate(keys):
+        equal_prefix = dict(zip(keys[:i], values[:i]))
+        condition |= Q(**equal_prefix, **{f'{key}__lt': values[i]})
+    return condition
+
+
+class CursorPage:
+    # Страница курсорной пагинации, совместимая по использованию в шаблонах со страницей Paginator
+    is_cursor = True
+
+    def __init__(self, object_list, next_cursor, has_previous):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def paginate_by_cursor(objects, keys, after=None, per_page=15):
+    # Пагинация по ключам keys (по убыванию) без COUNT(*) и OFFSET
+    values = decode_cursor(after, len(keys)) if after else None
+    objects = objects.order_by(*[f'-{key}' for key in keys])
+    if values is not None:
+        objects = objects.filter(keyset_filter(keys, values))
+
+    # Лишний объект нужен только для того, чтобы узнать, есть ли следующая страница
+    items = list(objects[:per_page + 1])
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        next_cursor = encode_cursor([getattr(items[-1], key) for key in keys])
+    return CursorPage(items, next_cursor, has_previous=values is not None)
+
+
+def paginate_feed(objects, params, keys, per_page=15):
+    # Выбор режима пагинации ленты вопросов: курсорный включается настройкой CURSOR_PAGINATION
+    if settings.CURSOR_PAGINATION:
+        return paginate_by_cursor(objects, keys, params.get('after'), per_page)
+    return Question.paginate_questions(objects, params.get('page', 1), per_page)
@@ -0,0 +1,216 @@
+import heapq
+import logging
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.template.backends import django as django_backend
+
+logger = logging.getLogger(__name__)
+
+# Метрики текущего запроса; asgiref переносит контекст в потоки sync_to_async
+current_metrics = ContextVar('current_metrics', default=None)
+
+
+class RequestMetrics:
+    # Время и SQL-запросы одного запроса
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view_started = None
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        # Самые долгие запросы: куча (время, номер, SQL) ограниченного размера
+        self.slowest_queries = []
+
+    def add_query(self, sql, elapsed):
+        self.sql_count += 1
+        self.sql_time += elapsed
+        item = (elapsed, self.sql_count, sql)
+        if len(self.slowest_queries) < settings.PERFORMANCE_SLOW_QUERIES:
+            heapq.heappush(self.slowest_queries, item)
+        else:
+            heapq.heappushpop(self.slowest_queries, item)
+
+
+def record_query(execute, sql, params, many, context):
+    # Обертка выполнения SQL, ставится на каждое соединение при его открытии
+    metrics = current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.add_query(sql, time.perf_counter() - started)
+
+
+class Template(django_backend.Template):
+    # Шаблон, время отрисовки которого учитывается в метриках запроса.
+    # Вложенные отрисовки (include) входят во время внешнего шаблона и отдельно не считаются
+
+    def render(self, context=None, request=None):
+        metrics = current_metrics.get()
+        if metrics is None:
+            return super().render(context, request)
+        metrics.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_depth -= 1
+            if not metrics.template_depth:
+                metrics.template_time += time.perf_counter() - started
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    # Стандартный бэкенд шаблонов Django с учетом времени отрисовки
+
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return Template(self.engine.get_template(template_name), self)
+        except django_backend.TemplateDoesNotExist as exc:
+            django_backend.reraise(exc, self)
+
+
+class RequestStatsBuffer:
+    # Счетчики по именам адресов копятся в памяти процесса и раз в PERFORMANCE_FLUSH_SECONDS
+    # прибавляются к таблице RequestStat, общей для всех процессов сервера
+
+    def __init__(self):
+        self._stats = {}
+        self._flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, url_name, metrics, total_time, view_time, slow):
+        self._merge(url_name, {
+            'requests': 1, 'slow_requests': int(slow), 'total_time': total_time, 'max_time': total_time,
+            'view_time': view_time, 'sql_queries': metrics.sql_count, 'sql_time': metrics.sql_time,
+            'template_time': metrics.template_time,
+        })
+
+    def _merge(self, url_name, values):
+        with self._lock:
+            stats = self._stats.setdefault(url_name, dict.fromkeys(values, 0))
+            for field, value in values.items():
+                stats[field] = max(stats[field], value) if field == 'max_time' else stats[field] + value
+
+    def flush_due(self):
+        return time.monotonic() - self._flushed_at >= settings.PERFORMANCE_FLUSH_SECONDS
+
+    def flush(self):
+        from .models import RequestStat
+
+        with self._lock:
+            stats, self._stats = self._stats, {}
+            self._flushed_at = time.monotonic()
+        pending = list(stats.items())
+        try:
+            while pending:
+                url_name, values = pending[0]
+                updates = {field: F(field) + value for field, value in values.items() if field != 'max_time'}
+                updates['max_time'] = Greatest(F('max_time'), values['max_time'])
+                if not RequestStat.objects.filter(url_name=url_name).update(**updates):
+                    try:
+                        with transaction.atomic():
+                            RequestStat.objects.create(url_name=url_name, **values)
+                    except IntegrityError:
+                        # Строку успел создать другой процесс
+                        RequestStat.objects.filter(url_name=url_name).update(**updates)
+                pending.pop(0)
+        finally:
+            # Незаписанные из-за ошибки счетчики возвращаются и записываются в следующий раз
+            for url_name, values in pending:
+                self._merge(url_name, values)
+
+    def flush_safely(self):
+        # Сброс из обработки запроса: ошибка записи (например, база заблокирована нагрузкой)
+        # пишется в журнал и не превращает уже готовый ответ в ошибку
+        try:
+            self.flush()
+        except DatabaseError:
+            logger.exception('Failed to flush request stats')
+
+
+request_stats = RequestStatsBuffer()
+
+
+def server_timing(metrics, total_time, view_time):
+    return ', '.join([
+        f'db;dur={metrics.sql_time * 1000:.1f};desc="SQL x{metrics.sql_count}"',
+        f'tpl;dur={metrics.template_time * 1000:.1f}',
+        f'view;dur={view_time * 1000:.1f}',
+        f'total;dur={total_time * 1000:.1f}',
+    ])
+
+
+class PerformanceMiddleware:
+    # Метрики запроса: SQL (количество и время), отрисовка шаблонов, время представления и полное время.
+    # Отдаются в заголовке Server-Timing, медленные запросы пишутся в журнал вместе с самыми долгими
+    # SQL-запросами, счетчики по именам адресов накапливаются в RequestStat (команда performance_stats)
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        self.finish(request, response, metrics)
+        if request_stats.flush_due():
+            request_stats.flush_safely()
+        return response
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        self.finish(request, response, metrics)
+        if request_stats.flush_due():
+            await sync_to_async(request_stats.flush_safely)()
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = current_metrics.get()
+        if metrics is not None:
+            metrics.view_started = time.perf_counter()
+
+    def finish(self, request, response, metrics):
+        finished = time.perf_counter()
+        total_time = finished - metrics.started
+        view_time = finished - metrics.view_started if metrics.view_started is not None else 0.0
+        response['Server-Timing'] = server_timing(metrics, total_time, view_time)
+
+        slow = total_time * 1000 >= settings.PERFORMANCE_SLOW_REQUEST_MS
+        if slow:
+            queries = ''.join(f'\n  {elapsed * 1000:.1f} ms: {sql}'
+                              for elapsed, _, sql in sorted(metrics.slowest_queries, reverse=True))
+            logger.warning('Slow request %s %s: %.1f ms, %d SQL queries in %.1f ms, templates %.1f ms%s',
+                           request.method, request.path, total_time * 1000, metrics.sql_count,
+                           metrics.sql_time * 1000, metrics.template_time * 1000, queries)
+
+        match = request.resolver_match
+        request_stats.add(match.view_name if match else '<unresolved>', metrics, total_time, view_time, slow)
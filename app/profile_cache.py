@@ -0,0 +1,48 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class ProfileCache:
+    # Профили вместе с пользователями по id пользователя в памяти процесса, вытесняются давно
+    # не запрашивавшиеся (LRU) сверх PROFILE_CACHE_SIZE. Запись сбрасывается при сохранении профиля
+    # или пользователя в этом процессе, а изменения из других процессов и обновления через update()
+    # (рейтинг) подхватываются не позже чем через PROFILE_CACHE_TIMEOUT секунд.
+
+    def __init__(self):
+        self._profiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        # Копия профиля, чтобы запросы не меняли общий объект; None, если профиля нет
+        from .models import Profile
+
+        with self._lock:
+            item = self._profiles.get(user_id)
+            if item is not None and time.monotonic() - item[1] <= settings.PROFILE_CACHE_TIMEOUT:
+                self._profiles.move_to_end(user_id)
+                return copy.deepcopy(item[0])
+
+        profile = Profile.objects.select_related('user').filter(user_id=user_id).first()
+        if profile is None:
+            return None
+        with self._lock:
+            self._profiles[user_id] = (profile, time.monotonic())
+            self._profiles.move_to_end(user_id)
+            while len(self._profiles) > settings.PROFILE_CACHE_SIZE:
+                self._profiles.popitem(last=False)
+            return copy.deepcopy(profile)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._profiles.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._profiles.clear()
+
+
+profile_cache = ProfileCache()
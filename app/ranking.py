@@ -0,0 +1,33 @@
+import math
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+
+
+def hot_score(rating, answer_count, created_at):
+    # Оценка "горячести" вопроса: логарифм активности плюс время создания, деленное на период затухания.
+    # Чтобы остаться наравне с вопросом, созданным на HOT_DECAY_SECONDS позже, нужна в 10 раз большая активность.
+    # Оценка не зависит от текущего времени, поэтому ее достаточно пересчитывать при голосах и ответах.
+    activity = rating + settings.HOT_ANSWER_WEIGHT * answer_count
+    order = math.log10(max(abs(activity), 1))
+    sign = (activity > 0) - (activity < 0)
+    return round(sign * order + created_at.timestamp() / settings.HOT_DECAY_SECONDS, 7)
+
+
+def rebuild_hot_scores(question_model, batch_size=1000):
+    # Полный пересчет оценок порциями по batch_size вопросов; принимает модель,
+    # чтобы работать и с исторической моделью в миграции
+    questions = question_model.objects.annotate(answers=Count('answer')).only('id', 'rating', 'created_at')
+    last_id = 0
+    updated = 0
+    while True:
+        batch = list(questions.filter(id__gt=last_id).order_by('id')[:batch_size])
+        if not batch:
+            return updated
+        for question in batch:
+            question.hot_score = hot_score(question.rating, question.answers, question.created_at)
+        with transaction.atomic():
+            question_model.objects.bulk_update(batch, ['hot_score'])
+        last_id = batch[-1].id
+        updated += len(batch)
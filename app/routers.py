@@ -0,0 +1,101 @@
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Состояние маршрутизации текущего запроса; вне запросов (команды, оболочка) все идет в основную базу
+current_routing = ContextVar('current_routing', default=None)
+
+# Приложения, которые всегда читают из основной базы: сессия, не дошедшая до реплики, разлогинила бы пользователя
+PRIMARY_APP_LABELS = {'sessions'}
+
+
+class RoutingState:
+    def __init__(self, pinned=False):
+        # pinned - запрос уже писал в основную базу или пользователь писал в нее недавно
+        self.pinned = pinned
+        self.replica = None
+
+
+class PrimaryReplicaRouter:
+    # Запись - в основную базу default, чтение в запросе - в одну из реплик DATABASE_REPLICAS,
+    # выбранную на весь запрос. После первой записи запрос до конца читает из основной базы,
+    # а DatabaseRoutingMiddleware закрепляет за ней и следующие запросы пользователя на время
+    # отставания реплик, чтобы пользователь сразу видел свой голос или ответ
+
+    def db_for_read(self, model, **hints):
+        state = current_routing.get()
+        replicas = settings.DATABASE_REPLICAS
+        if state is None or state.pinned or not replicas or model._meta.app_label in PRIMARY_APP_LABELS:
+            return DEFAULT_DB_ALIAS
+        # Внутри транзакции чтение должно видеть ее же изменения
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        if state.replica is None:
+            state.replica = random.choice(replicas)
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = current_routing.get()
+        if state is not None:
+            state.pinned = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и основная база
+        pool = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схема попадает в реплики вместе с данными
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class DatabaseRoutingMiddleware:
+    # Состояние маршрутизации на время запроса. Запрос, который писал в базу, ставит cookie
+    # DATABASE_PIN_COOKIE на DATABASE_PIN_SECONDS: пока она есть, запросы читают из основной базы
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        state = self.start(request)
+        token = current_routing.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_routing.reset(token)
+        return self.finish(response, state)
+
+    async def __acall__(self, request):
+        state = self.start(request)
+        token = current_routing.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_routing.reset(token)
+        return self.finish(response, state)
+
+    @staticmethod
+    def start(request):
+        return RoutingState(pinned=settings.DATABASE_PIN_COOKIE in request.COOKIES)
+
+    @staticmethod
+    def finish(response, state):
+        if state.pinned and settings.DATABASE_REPLICAS:
+            response.set_cookie(settings.DATABASE_PIN_COOKIE, '1', max_age=settings.DATABASE_PIN_SECONDS,
+                                httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,125 @@
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from .models import Answer, Question
+
+SEARCH_TABLE = 'app_search_index'
+
+# Максимальное количество результатов поиска
+SEARCH_LIMIT = 1000
+
+
+class SearchBackend:
+    # Базовый класс поискового индекса по заголовкам и текстам вопросов и ответов
+
+    def index_questions(self, questions):
+        pass
+
+    def index_answers(self, answers):
+        pass
+
+    def remove_question(self, question_id):
+        pass
+
+    def remove_answer(self, answer_id):
+        pass
+
+    def rebuild(self):
+        return 0
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        # Возвращает идентификаторы вопросов в порядке убывания релевантности
+        raise NotImplementedError
+
+
+class SimpleSearchBackend(SearchBackend):
+    # Поиск без индекса через LIKE, для баз без полнотекстового поиска
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        condition = Q()
+        for word in query.split():
+            condition &= (Q(title__icontains=word) | Q(content__icontains=word) |
+                          Q(answer__content__icontains=word))
+        if not condition:
+            return []
+        questions = Question.objects.filter(condition).order_by('-id').values_list('id', flat=True).distinct()
+        return list(questions[:limit])
+
+
+class SqliteSearchBackend(SearchBackend):
+    # Индекс SQLite FTS5. rowid записи: 2 * id для вопроса и 2 * id + 1 для ответа,
+    # поэтому обновление и удаление записи идут по первичному ключу индекса
+
+    def index_questions(self, questions):
+        rows = [(question.id * 2, question.title, question.content, question.id) for question in questions]
+        self._replace(rows)
+
+    def index_answers(self, answers):
+        rows = [(answer.id * 2 + 1, '', answer.content, answer.question_id) for answer in answers]
+        self._replace(rows)
+
+    def remove_question(self, question_id):
+        self._delete(question_id * 2)
+
+    def remove_answer(self, answer_id):
+        self._delete(answer_id * 2 + 1)
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {SEARCH_TABLE} (rowid, title, content, question_id) '
+                f'SELECT id * 2, title, content, id FROM {Question._meta.db_table}'
+            )
+            cursor.execute(
+                f'INSERT INTO {SEARCH_TABLE} (rowid, title, content, question_id) '
+                f"SELECT id * 2 + 1, '', content, question_id FROM {Answer._meta.db_table}"
+            )
+            cursor.execute(f'SELECT COUNT(*) FROM {SEARCH_TABLE}')
+            return cursor.fetchone()[0]
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        match = self.match_expression(query)
+        if not match:
+            return []
+        # Вопрос ранжируется по лучшему совпадению среди него самого и его ответов: записи идут
+        # по возрастанию rank (bm25 с весами из миграции), берется первое вхождение каждого вопроса
+        question_ids = {}
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT question_id FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s ORDER BY rank', [match]
+            )
+            for (question_id,) in cursor:
+                question_ids.setdefault(question_id, None)
+                if len(question_ids) >= limit:
+                    break
+        return list(question_ids)
+
+    @staticmethod
+    def match_expression(query):
+        # Слова запроса превращаются в префиксные термы FTS5, операторы и кавычки из ввода отбрасываются
+        words = re.findall(r'\w+', query)
+        return ' '.join(f'"{word}"*' for word in words)
+
+    def _replace(self, rows):
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(
+                f'INSERT INTO {SEARCH_TABLE} (rowid, title, content, question_id) VALUES (%s, %s, %s, %s)', rows
+            )
+
+    def _delete(self, rowid):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [rowid])
+
+
+@lru_cache(maxsize=None)
+def get_search_backend():
+    return import_string(settings.SEARCH_BACKEND)()
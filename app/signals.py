@@ -0,0 +1,134 @@
+from django.contrib.auth.models import User
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .context_processors import invalidate_sidebar
+from .models import Answer, Profile, Question, Tag
+from .performance import record_query
+from .profile_cache import profile_cache
+from .search import get_search_backend
+from .sqlite import configure_connection
+from .stamps import FEED_STAMP, question_stamp, touch_on_commit
+from .tag_index import tag_index
+
+# Поля, от которых зависит поисковый индекс
+SEARCH_FIELDS = {'title', 'content'}
+
+
+@receiver(post_save, sender=Answer)
+def answer_saved(sender, instance, created, raw=False, **kwargs):
+    # Счетчик ответов меняется при любом способе создания (форма, админка), как и уменьшается при удалении.
+    # Вызывающий код (AnswerForm, админка) сохраняет ответ в транзакции, и счетчик меняется в ней же
+    if created and not raw:
+        question = instance.question
+        question.change_answer_count(1)
+        question.update_hot_score()
+    # Новый неотмеченный ответ не меняет рейтинг пользователей
+    if not created or instance.correct:
+        invalidate_sidebar()
+
+
+@receiver(post_delete, sender=Answer)
+def answer_deleted(sender, instance, **kwargs):
+    # При удалении вопроса вместе с ответами вопроса уже может не быть
+    question = Question.objects.filter(pk=instance.question_id).first()
+    if question is not None:
+        question.change_answer_count(-1)
+        question.update_hot_score()
+    if instance.correct:
+        Profile.objects.filter(pk=instance.author_id).update(rating=F('rating') - 1)
+        invalidate_sidebar()
+
+
+@receiver(m2m_changed, sender=Question.tags.through)
+def question_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    invalidate_sidebar()
+    # Теги выводятся в карточке вопроса, поэтому меняется ее версия
+    if not reverse:
+        instance.bump_version()
+        touch_on_commit(question_stamp(instance.pk), FEED_STAMP)
+    elif pk_set:
+        Question.objects.filter(pk__in=pk_set).update(version=F('version') + 1)
+        touch_on_commit(*[question_stamp(pk) for pk in pk_set], FEED_STAMP)
+
+
+@receiver(post_delete, sender=Question)
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+@receiver(post_delete, sender=Tag)
+def sidebar_source_changed(sender, **kwargs):
+    invalidate_sidebar()
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def question_changed(sender, instance, **kwargs):
+    touch_on_commit(question_stamp(instance.pk), FEED_STAMP)
+
+
+@receiver(post_save, sender=Answer)
+@receiver(post_delete, sender=Answer)
+def answer_changed(sender, instance, **kwargs):
+    # Новый ответ меняет и ленты: количество ответов и порядок горячих вопросов
+    touch_on_commit(question_stamp(instance.question_id), FEED_STAMP)
+
+
+@receiver(post_save, sender=Question)
+def index_question(sender, instance, update_fields, **kwargs):
+    if update_fields is None or SEARCH_FIELDS & set(update_fields):
+        get_search_backend().index_questions([instance])
+
+
+@receiver(post_save, sender=Answer)
+def index_answer(sender, instance, update_fields, **kwargs):
+    if update_fields is None or SEARCH_FIELDS & set(update_fields):
+        get_search_backend().index_answers([instance])
+
+
+@receiver(post_delete, sender=Question)
+def unindex_question(sender, instance, **kwargs):
+    get_search_backend().remove_question(instance.id)
+
+
+@receiver(post_delete, sender=Answer)
+def unindex_answer(sender, instance, **kwargs):
+    get_search_backend().remove_answer(instance.id)
+
+
+@receiver(post_save, sender=Tag)
+def tag_saved(sender, instance, created, **kwargs):
+    if created:
+        tag_index.add([instance.name])
+    else:
+        tag_index.invalidate()
+
+
+@receiver(post_delete, sender=Tag)
+def tag_deleted(sender, **kwargs):
+    tag_index.invalidate()
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    configure_connection(sender, connection)
+    # Учет SQL-запросов в метриках запроса PerformanceMiddleware. Объект соединения переиспользуется
+    # при переподключении (CONN_MAX_AGE, проверки соединения), и обертка уже может стоять
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def profile_changed(sender, instance, **kwargs):
+    profile_cache.invalidate(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    # Смена пароля, активности или имени пользователя
+    profile_cache.invalidate(instance.pk)
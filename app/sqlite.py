@@ -0,0 +1,21 @@
+from django.conf import settings
+
+
+def apply_pragmas(connection, pragmas):
+    # Настройка нового соединения SQLite командами PRAGMA (имена и значения берутся из настроек)
+    for name, value in pragmas.items():
+        connection.connection.execute(f'PRAGMA {name} = {value}')
+
+
+def configure_connection(sender, connection, **kwargs):
+    # Обработчик connection_created: SQLITE_PRAGMAS применяются к каждому новому соединению SQLite
+    if connection.vendor == 'sqlite':
+        apply_pragmas(connection, settings.SQLITE_PRAGMAS)
+
+
+def copy_database(source, target):
+    # Полная копия базы SQLite через backup API. Используется как репликация
+    # при локальной проверке маршрутизации чтения на реплики (команда sync_replicas)
+    source.ensure_connection()
+    target.ensure_connection()
+    source.connection.backup(target.connection)
@@ -0,0 +1,63 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.core.cache import cache
+from django.db import transaction
+
+# Отметки времени последнего изменения страниц в кэше: лента вопросов, боковая панель
+# и отдельные вопросы. По ним отвечаем 304 Not Modified, не выполняя представление.
+# Используется только ETag: Last-Modified с точностью до секунды пропустил бы изменения в ту же секунду.
+# При нескольких процессах сервера кэш по умолчанию должен быть общим (memcached, redis),
+# иначе процесс не увидит изменений, сделанных другими
+FEED_STAMP = 'stamp:feed'
+SIDEBAR_STAMP = 'stamp:sidebar'
+
+
+def question_stamp(question_id):
+    return f'stamp:question:{question_id}'
+
+
+def touch(*keys):
+    cache.set_many(dict.fromkeys(keys, time.time()), timeout=None)
+
+
+def touch_on_commit(*keys):
+    # Отметка обновляется после фиксации транзакции, иначе страницу могли бы отрисовать
+    # по старым данным и закэшировать с новой отметкой
+    transaction.on_commit(lambda: touch(*keys))
+
+
+def get_stamps(*keys):
+    # Отсутствующая (вытесненная) отметка считается только что измененной
+    stamps = cache.get_many(keys)
+    for key in keys:
+        if key not in stamps:
+            cache.add(key, time.time(), timeout=None)
+            stamps[key] = cache.get(key, time.time())
+    return [stamps[key] for key in keys]
+
+
+def page_etag(request, *keys):
+    # Страница зависит от отметок, пользователя (навигация, права автора вопроса), CSRF-токена в формах
+    # и адреса с параметрами пагинации
+    stamps = get_stamps(*keys, SIDEBAR_STAMP)
+    # Реплика может еще не получить недавнее изменение: страница без ETag, чтобы не закрепить в кэше
+    # браузера устаревшую версию под новой отметкой
+    if settings.DATABASE_REPLICAS and time.time() - max(stamps) < settings.DATABASE_PIN_SECONDS:
+        return None
+    parts = stamps + [
+        request.session.get(SESSION_KEY, ''),
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+        request.get_full_path(),
+    ]
+    return hashlib.md5('|'.join(map(str, parts)).encode()).hexdigest()
+
+
+def feed_etag(request, *args, **kwargs):
+    return page_etag(request, FEED_STAMP)
+
+
+def question_etag(request, question_id):
+    return page_etag(request, question_stamp(question_id))
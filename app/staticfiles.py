@@ -0,0 +1,192 @@
+import gzip
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import urlparse
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.functional import cached_property
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Расширения файлов, для которых имеет смысл сжатие
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.map'}
+
+# Кэширование файлов с хэшем содержимого в имени: содержимое по такому адресу не меняется
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def minify_css(text):
+    # Удаление комментариев и лишних пробелов без разбора CSS
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+    # Пробелы после двоеточия убираются только в объявлениях внутри {...}, но не в селекторах
+    text = re.sub(r'\{[^{}]*\}', lambda match: re.sub(r':\s+', ':', match.group()), text)
+    return text.replace(';}', '}').strip()
+
+
+def minify_js(text):
+    # Построчное сокращение без разбора JavaScript: отступы, пустые строки и строки из одного комментария.
+    # Многострочные шаблонные строки со строками, начинающимися с //, так испортятся - в проекте их нет
+    lines = (line.strip() for line in text.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//')) + '\n'
+
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+
+def compressors():
+    # Варианты предварительного сжатия: расширение файла и функция сжатия
+    yield '.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0)
+    if brotli is not None:
+        yield '.br', lambda data: brotli.compress(data, quality=11)
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    # Хэш содержимого в именах файлов (манифест Django), плюс при collectstatic файлы с хэшем
+    # сокращаются и рядом с ними сохраняются сжатые копии .gz и .br (если установлен brotli)
+
+    def stored_name(self, name):
+        # До первого collectstatic манифеста нет, и ссылки ведут на исходные файлы (разработка, тесты)
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        # Сокращаются только собственные файлы проекта из STATICFILES_DIRS, файлы приложений
+        # (например, админки) только сжимаются
+        own_locations = {os.path.abspath(root[1] if isinstance(root, (list, tuple)) else root)
+                         for root in settings.STATICFILES_DIRS}
+        own_names = {name for name, (storage, _) in paths.items()
+                     if os.path.abspath(storage.location) in own_locations}
+        hashed_names = {}
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            if hashed_name and not isinstance(processed, Exception):
+                hashed_names[name] = hashed_name
+            yield name, hashed_name, processed
+        if dry_run:
+            return
+        for name, hashed_name in hashed_names.items():
+            for compressed_name in self.optimize(hashed_name, minify=name in own_names):
+                yield name, compressed_name, True
+
+    def optimize(self, name, minify=True):
+        extension = os.path.splitext(name)[1]
+        if extension not in COMPRESSIBLE_EXTENSIONS:
+            return
+        with self.open(name) as file:
+            content = file.read()
+
+        minifier = MINIFIERS.get(extension) if minify else None
+        if minifier is not None:
+            content = minifier(content.decode()).encode()
+            self.replace(name, content)
+
+        for suffix, compress in compressors():
+            compressed = compress(content)
+            # Сжатая копия, которая не меньше исходной, не нужна
+            if len(compressed) < len(content):
+                self.replace(name + suffix, compressed)
+                yield name + suffix
+
+    def replace(self, name, content):
+        # Хранилище не перезаписывает существующие файлы, а подбирает новое имя
+        if self.exists(name):
+            self.delete(name)
+        self._save(name, ContentFile(content))
+
+
+def accepted_encodings(header):
+    # Кодировки из Accept-Encoding, не запрещенные через q=0
+    encodings = set()
+    for item in header.split(','):
+        encoding, _, params = item.strip().partition(';')
+        quality = params.strip().removeprefix('q=')
+        try:
+            if params and float(quality) == 0:
+                continue
+        except ValueError:
+            continue
+        encodings.add(encoding.strip().lower())
+    return encodings
+
+
+class StaticFilesMiddleware:
+    # Отдача собранных collectstatic файлов из STATIC_ROOT: файлы с хэшем в имени кэшируются на год,
+    # остальные - на STATIC_CACHE_MAX_AGE секунд; клиенту, поддерживающему br или gzip, отдается
+    # заранее сжатая копия. Если файла в STATIC_ROOT нет, запрос обрабатывается дальше
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.prefix = urlparse(settings.STATIC_URL).path
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.serve(request) or self.get_response(request)
+
+    async def __acall__(self, request):
+        return self.serve(request) or await self.get_response(request)
+
+    @cached_property
+    def hashed_names(self):
+        # Имена файлов с хэшем из манифеста; манифест читается при запуске процесса
+        return set(staticfiles_storage.hashed_files.values())
+
+    def serve(self, request):
+        if not settings.STATIC_ROOT or request.method not in ('GET', 'HEAD'):
+            return None
+        if not request.path.startswith(self.prefix):
+            return None
+        name = posixpath.normpath(request.path[len(self.prefix):]).lstrip('/')
+        try:
+            path = safe_join(settings.STATIC_ROOT, name)
+        except SuspiciousFileOperation:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if not os.path.isfile(path):
+            return None
+
+        if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime):
+            response = HttpResponseNotModified()
+        else:
+            content_type, _ = mimetypes.guess_type(name)
+            response, encoding = self.open_variant(request, path)
+            response['Content-Type'] = content_type or 'application/octet-stream'
+            if encoding:
+                response['Content-Encoding'] = encoding
+            response['Last-Modified'] = http_date(stat.st_mtime)
+        if os.path.splitext(name)[1] in COMPRESSIBLE_EXTENSIONS:
+            response['Vary'] = 'Accept-Encoding'
+        response['Cache-Control'] = (IMMUTABLE_CACHE_CONTROL if name in self.hashed_names
+                                     else f'public, max-age={settings.STATIC_CACHE_MAX_AGE}')
+        return response
+
+    @staticmethod
+    def open_variant(request, path):
+        encodings = accepted_encodings(request.headers.get('Accept-Encoding', ''))
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if encoding in encodings and os.path.isfile(path + suffix):
+                return FileResponse(open(path + suffix, 'rb')), encoding
+        return FileResponse(open(path, 'rb')), None
@@ -0,0 +1,51 @@
+import bisect
+import threading
+import time
+
+from django.conf import settings
+
+
+class TagPrefixIndex:
+    # Отсортированный в памяти процесса список имен тегов для автодополнения по префиксу.
+    # Новые теги добавляются при создании, а полная перезагрузка раз в TAG_INDEX_TIMEOUT секунд
+    # подхватывает теги, созданные другими процессами.
+
+    def __init__(self):
+        self._names = None
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    def _get_names(self):
+        from .models import Tag
+
+        with self._lock:
+            if self._names is None or time.monotonic() - self._loaded_at > settings.TAG_INDEX_TIMEOUT:
+                self._names = sorted(Tag.objects.values_list('name', flat=True))
+                self._loaded_at = time.monotonic()
+            return self._names
+
+    def complete(self, prefix, limit=10):
+        names = self._get_names()
+        start = bisect.bisect_left(names, prefix)
+        result = []
+        for name in names[start:start + limit]:
+            if not name.startswith(prefix):
+                break
+            result.append(name)
+        return result
+
+    def add(self, names):
+        with self._lock:
+            if self._names is None:
+                return
+            for name in names:
+                position = bisect.bisect_left(self._names, name)
+                if position == len(self._names) or self._names[position] != name:
+                    self._names.insert(position, name)
+
+    def invalidate(self):
+        with self._lock:
+            self._names = None
+
+
+tag_index = TagPrefixIndex()
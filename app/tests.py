@@ -1,3 +1,476 @@
-from django.test import TestCase
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.db import IntegrityError, OperationalError, connection
+from django.db.models import F
+from django.http import HttpResponse
+from django.core.management import call_command
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from .events import question_events
+from .models import Answer, Profile, Question, RequestStat, Tag, Vote
+from .pagination import decode_cursor, encode_cursor, paginate_by_cursor
+from .performance import RequestMetrics, record_query, request_stats
+from .profile_cache import profile_cache
+from .routers import DatabaseRoutingMiddleware, PrimaryReplicaRouter
+from .signals import connection_opened
+from .staticfiles import minify_css
+from .tag_index import tag_index
+from .thumbnails import thumbnail_names
+from .vote_buffer import VoteBuffer, VoteJournal, write_votes
+from .votes import MAX_BATCH_VOTES, MAX_VOTE_ATTEMPTS, apply_vote
+
+
+def create_profile(name):
+    user = User.objects.create_user(username=name, email=f'{name}@example.com')
+    return Profile.objects.create(user=user, nickname=name)
+
+
+class VoteTestMixin:
+    def setUp(self):
+        self.author = create_profile('author')
+        self.voter = create_profile('voter')
+        self.other = create_profile('other')
+        self.question = Question.objects.create(title='Вопрос', content='Текст', author=self.author)
+        self.answer = Answer.objects.create(content='Ответ', question=self.question, author=self.author)
+
+    def assertTally(self, item, likes, dislikes):
+        item.refresh_from_db()
+        self.assertEqual((item.likes, item.dislikes, item.rating), (likes, dislikes, likes - dislikes))
+        target = {'question': item} if isinstance(item, Question) else {'answer': item}
+        votes = Vote.objects.filter(**target)
+        self.assertEqual(votes.filter(value=Vote.LIKE).count(), likes)
+        self.assertEqual(votes.filter(value=Vote.DISLIKE).count(), dislikes)
+
+
+class CursorPaginationTests(TestCase):
+    def test_invalid_cursor(self):
+        for token in ['', 'not-base64!', encode_cursor({'id': 1}), encode_cursor([1]), encode_cursor([1.5, True]),
+                      encode_cursor([1.5, '2']), encode_cursor([2.5, 3])[:-2]]:
+            with self.subTest(token=token):
+                self.assertIsNone(decode_cursor(token, 2))
+        page = paginate_by_cursor(Question.objects.all(), ['hot_score', 'id'], 'not-base64!')
+        self.assertFalse(page.has_previous)
+
+    def test_float_ties_broken_by_id(self):
+        author = create_profile('author')
+        ids = [Question.objects.create(title=f'Вопрос {i}', content='Текст', author=author).id for i in range(5)]
+        Question.objects.update(hot_score=0.1 + 0.2)
+        Question.objects.filter(id=ids[2]).update(hot_score=1.5)
+
+        pages = []
+        after = None
+        while True:
+            page = paginate_by_cursor(Question.objects.all(), ['hot_score', 'id'], after, per_page=2)
+            pages.append([question.id for question in page])
+            if not page.has_next:
+                break
+            after = page.next_cursor
+        self.assertEqual(pages, [[ids[2], ids[4]], [ids[3], ids[1]], [ids[0]]])
+        self.assertIsNone(page.next_cursor)
+
+
+class TagIndexTests(TestCase):
+    def setUp(self):
+        tag_index.invalidate()
+        tag_index.complete('')
+        self.addCleanup(tag_index.invalidate)
+
+    def test_added_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.get_or_create_by_names(['django', 'djangorest'])
+            self.assertEqual(tag_index.complete('djan'), [])
+        self.assertEqual(tag_index.complete('djan'), ['django', 'djangorest'])
+
+
+class ApplyVoteTests(VoteTestMixin, TestCase):
+    def test_create(self):
+        self.assertEqual(apply_vote(self.voter, self.question, Vote.LIKE), 1)
+        self.assertTally(self.question, 1, 0)
+
+    def test_toggle_off(self):
+        apply_vote(self.voter, self.question, Vote.LIKE)
+        self.assertEqual(apply_vote(self.voter, self.question, Vote.LIKE), 0)
+        self.assertTally(self.question, 0, 0)
+
+    def test_switch(self):
+        apply_vote(self.voter, self.answer, Vote.LIKE)
+        self.assertEqual(apply_vote(self.voter, self.answer, Vote.DISLIKE), -1)
+        self.assertTally(self.answer, 0, 1)
+
+    def test_votes_of_different_users(self):
+        apply_vote(self.voter, self.question, Vote.LIKE)
+        apply_vote(self.other, self.question, Vote.DISLIKE)
+        apply_vote(self.author, self.question, Vote.LIKE)
+        self.assertTally(self.question, 2, 1)
+        # Голос за вопрос не влияет на ответ
+        self.assertTally(self.answer, 0, 0)
+
+    def test_retry_after_concurrent_create(self):
+        create = Vote.objects.create
+        calls = []
+
+        def create_once_conflicting(**kwargs):
+            # Первая вставка натыкается на голос, созданный параллельным запросом
+            calls.append(kwargs)
+            if len(calls) == 1:
+                raise IntegrityError('UNIQUE constraint failed')
+            return create(**kwargs)
+
+        with mock.patch.object(Vote.objects, 'create', side_effect=create_once_conflicting):
+            self.assertEqual(apply_vote(self.voter, self.question, Vote.LIKE), 1)
+        self.assertEqual(len(calls), 2)
+        self.assertTally(self.question, 1, 0)
+
+    def test_retry_gives_up(self):
+        apply_vote(self.other, self.question, Vote.LIKE)
+        with mock.patch.object(Vote.objects, 'create', side_effect=IntegrityError('UNIQUE constraint failed')) as create:
+            with self.assertRaises(IntegrityError):
+                apply_vote(self.voter, self.question, Vote.LIKE)
+        self.assertEqual(create.call_count, MAX_VOTE_ATTEMPTS)
+        # Транзакция откатилась целиком: счетчики не изменились
+        self.assertTally(self.question, 1, 0)
+
+
+class VotesBatchTests(VoteTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.voter.user)
+
+    def post_votes(self, body):
+        return self.client.post(reverse('votes_batch'), body, content_type='application/json')
+
+    def test_final_counts(self):
+        response = self.post_votes({'votes': [
+            {'type': 'question', 'id': self.question.id, 'like_type': 'like'},
+            {'type': 'answer', 'id': self.answer.id, 'like_type': 'like'},
+            {'type': 'question', 'id': self.question.id, 'like_type': 'dislike'},
+        ]})
+        self.assertEqual(response.json(), {'votes': [
+            {'type': 'question', 'id': self.question.id, 'count': -1},
+            {'type': 'answer', 'id': self.answer.id, 'count': 1},
+        ]})
+        self.assertTally(self.question, 0, 1)
+        self.assertTally(self.answer, 1, 0)
+
+    def test_malformed(self):
+        vote = {'type': 'question', 'id': self.question.id, 'like_type': 'like'}
+        for body in ['{"votes": [', {'votes': []}, {'votes': [dict(vote, type='tag')]},
+                     {'votes': [dict(vote, id='1')]}, {'votes': [vote] * (MAX_BATCH_VOTES + 1)}]:
+            with self.subTest(body=str(body)[:60]):
+                self.assertEqual(self.post_votes(body).status_code, 400)
+        self.assertFalse(Vote.objects.exists())
+
+    def test_unknown_id(self):
+        response = self.post_votes({'votes': [
+            {'type': 'question', 'id': self.question.id, 'like_type': 'like'},
+            {'type': 'answer', 'id': self.answer.id + 100, 'like_type': 'like'},
+        ]})
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Vote.objects.exists())
+
+
+class QuestionPageTests(VoteTestMixin, TestCase):
+    def test_user_without_profile(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com')
+        self.client.force_login(admin)
+        response = self.client.get(reverse('question', kwargs={'question_id': self.question.id}))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context['is_question_author'])
+
+    def test_question_author(self):
+        self.client.force_login(self.author.user)
+        response = self.client.get(reverse('question', kwargs={'question_id': self.question.id}))
+        self.assertTrue(response.context['is_question_author'])
+
+    def test_events_under_wsgi(self):
+        # Без ASGI страница не открывает поток и не ждет событий в long-poll, а опрашивает сервер
+        response = self.client.get(reverse('question', kwargs={'question_id': self.question.id}))
+        self.assertContains(response, 'data-events-stream="0"')
+        response = self.client.get(reverse('question_stream', kwargs={'question_id': self.question.id}))
+        self.assertEqual(response.status_code, 204)
+        with mock.patch.object(question_events, 'wait', return_value=[]) as wait:
+            response = self.client.get(reverse('question_poll', kwargs={'question_id': self.question.id}),
+                                       {'after': question_events.last_id})
+        self.assertEqual(response.json(), {'events': [], 'last_id': question_events.last_id})
+        self.assertEqual(wait.call_args.args[2], 0)
+
+    async def test_events_under_asgi(self):
+        response = await self.async_client.get(reverse('question', kwargs={'question_id': self.question.id}))
+        self.assertContains(response, 'data-events-stream="1"')
+
+
+class ETagTests(VoteTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.urls = [reverse('index'), reverse('question', kwargs={'question_id': self.question.id})]
+        # ETag зависит от cookie CSRF, которую клиент получает с первой страницей
+        self.client.get(self.urls[1])
+
+    def etags(self):
+        return [self.client.get(url).headers['ETag'] for url in self.urls]
+
+    def test_not_modified(self):
+        for url, etag in zip(self.urls, self.etags()):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_invalidated(self):
+        tag = Tag.objects.create(name='django')
+        changes = {
+            'vote': lambda: apply_vote(self.voter, self.question, Vote.LIKE),
+            'answer': lambda: Answer.objects.create(content='Еще ответ', question=self.question, author=self.voter),
+            'tags': lambda: self.question.tags.add(tag),
+        }
+        for name, change in changes.items():
+            with self.subTest(change=name):
+                etags = self.etags()
+                # Отметки обновляются после фиксации транзакции
+                with self.captureOnCommitCallbacks(execute=True):
+                    change()
+                for url, etag in zip(self.urls, etags):
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertNotEqual(response.headers['ETag'], etag)
+
+
+class VersionTests(VoteTestMixin, TestCase):
+    def test_save_keeps_concurrent_bumps(self):
+        # Объект загружен до голоса, который увеличил версию в базе
+        question = Question.objects.get(pk=self.question.pk)
+        version = question.version
+        apply_vote(self.voter, self.question, Vote.LIKE)
+        question.content = 'Новый текст'
+        question.save()
+        self.question.refresh_from_db()
+        self.assertEqual(question.version, self.question.version)
+        self.assertEqual(self.question.version, version + 2)
+        self.assertEqual(self.question.content, 'Новый текст')
+
+
+class MinifyTests(SimpleTestCase):
+    def test_css(self):
+        css = '/* шапка */\na :hover, b > i {\n  color: red;\n}\n@media (max-width: 600px) { .b { margin: 0 } }\n'
+        self.assertEqual(minify_css(css), 'a :hover,b>i{color:red}@media (max-width: 600px){.b{margin:0}}')
+
+
+class ThumbnailTests(SimpleTestCase):
+    def test_names_keep_source_extension(self):
+        self.assertEqual(thumbnail_names('img/avatars/cat.jpg')[:2],
+                         ['img/avatars/cat.jpg.thumb-1x.webp', 'img/avatars/cat.jpg.thumb-1x.png'])
+        self.assertFalse(set(thumbnail_names('img/avatars/cat.jpg')) & set(thumbnail_names('img/avatars/cat.png')))
+
+
+class PerformanceTests(TestCase):
+    def test_wrapper_installed_once(self):
+        # Сигнал приходит при каждом переподключении того же объекта соединения; PRAGMA внутри
+        # транзакции теста не выполняются
+        with mock.patch('app.signals.configure_connection'):
+            for _ in range(3):
+                connection_opened(sender=connection.__class__, connection=connection)
+        self.assertEqual(connection.execute_wrappers.count(record_query), 1)
+
+    def test_failed_flush_keeps_stats(self):
+        # Счетчики запросов из предыдущих тестов
+        request_stats.flush()
+        RequestStat.objects.all().delete()
+        metrics = RequestMetrics()
+        metrics.sql_count = 2
+        request_stats.add('index', metrics, 0.5, 0.25, False)
+        with mock.patch.object(RequestStat.objects, 'filter', side_effect=OperationalError('database is locked')):
+            with self.assertLogs('app.performance', 'ERROR'):
+                request_stats.flush_safely()
+        request_stats.add('index', metrics, 0.75, 0.25, True)
+        request_stats.flush()
+        stat = RequestStat.objects.get(url_name='index')
+        self.assertEqual((stat.requests, stat.slow_requests, stat.sql_queries), (2, 1, 4))
+        self.assertEqual(stat.max_time, 0.75)
+
+
+class AnswerCountTests(VoteTestMixin, TestCase):
+    def test_counted_on_any_create_and_delete(self):
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.answer_count, 1)
+        # Ответ, созданный не через форму (как в админке)
+        answer = Answer.objects.create(content='Еще ответ', question=self.question, author=self.voter)
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.answer_count, 2)
+        answer.delete()
+        self.answer.delete()
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.answer_count, 0)
+
+    def test_answer_form(self):
+        self.client.force_login(self.voter.user)
+        response = self.client.post(reverse('question', kwargs={'question_id': self.question.id}),
+                                    {'content': 'Ответ из формы'})
+        self.assertEqual(response.status_code, 302)
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.answer_count, 2)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class RoutingTests(SimpleTestCase):
+    def request(self, write=False, **cookies):
+        # Базы, выбранные маршрутизатором для чтения вопроса и сессии внутри запроса
+        router = PrimaryReplicaRouter()
+        databases = []
+
+        def view(request):
+            if write:
+                router.db_for_write(Vote)
+            databases.extend([router.db_for_read(Question), router.db_for_read(Session)])
+            return HttpResponse()
+
+        request = RequestFactory().get('/')
+        request.COOKIES.update(cookies)
+        return DatabaseRoutingMiddleware(view)(request), databases
+
+    def test_reads_from_replica(self):
+        response, databases = self.request()
+        self.assertEqual(databases, ['replica', 'default'])
+        self.assertNotIn('primary_pin', response.cookies)
+        # Вне запроса (команды, оболочка) чтение из основной базы
+        self.assertEqual(PrimaryReplicaRouter().db_for_read(Question), 'default')
+
+    def test_pinned_after_write(self):
+        response, databases = self.request(write=True)
+        self.assertEqual(databases, ['default', 'default'])
+        self.assertEqual(response.cookies['primary_pin']['max-age'], 5)
+        _, databases = self.request(primary_pin='1')
+        self.assertEqual(databases, ['default', 'default'])
+
+
+# Быстрое хэширование паролей в тестах регистрации
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class SignupTests(TestCase):
+    def test_signup(self):
+        response = self.client.post(reverse('signup'), {
+            'username': 'newuser', 'email': 'newuser@example.com', 'password': 'secret-password',
+            're_password': 'secret-password',
+        })
+        self.assertRedirects(response, reverse('index'), fetch_redirect_response=False)
+        user = User.objects.get(username='newuser')
+        self.assertEqual(user.profile.nickname, 'newuser')
+        self.assertEqual(int(self.client.session['_auth_user_id']), user.id)
+        response = self.client.get(reverse('settings'))
+        self.assertEqual(response.status_code, 200)
+
+
+class ProfileCacheTests(TestCase):
+    def setUp(self):
+        self.profile = create_profile('member')
+        profile_cache.clear()
+
+    def test_settings_does_not_write_stale_rating(self):
+        self.client.force_login(self.profile.user)
+        # Профиль попадает в кэш, затем рейтинг меняется в обход сохранения модели
+        self.client.get(reverse('settings'))
+        Profile.objects.filter(pk=self.profile.pk).update(rating=F('rating') + 5)
+        response = self.client.post(reverse('settings'), {'nickname': 'renamed', 'email': 'renamed@example.com'})
+        self.assertEqual(response.status_code, 302)
+        self.profile.refresh_from_db()
+        self.assertEqual((self.profile.nickname, self.profile.rating), ('renamed', 5))
+
+    def test_invalidated_on_save(self):
+        self.assertEqual(profile_cache.get(self.profile.user_id).nickname, 'member')
+        self.profile.nickname = 'renamed'
+        self.profile.save()
+        self.assertEqual(profile_cache.get(self.profile.user_id).nickname, 'renamed')
+
+
+class WriteVotesTests(VoteTestMixin, TestCase):
+    def states(self):
+        return {
+            (self.voter.id, 'question', self.question.id): Vote.LIKE,
+            (self.other.id, 'question', self.question.id): Vote.DISLIKE,
+            (self.author.id, 'question', self.question.id): None,
+            (self.voter.id, 'answer', self.answer.id): Vote.DISLIKE,
+        }
+
+    def test_write(self):
+        apply_vote(self.author, self.question, Vote.LIKE)
+        apply_vote(self.voter, self.question, Vote.DISLIKE)
+        write_votes(self.states())
+        self.assertTally(self.question, 1, 1)
+        self.assertTally(self.answer, 0, 1)
+
+    def test_write_twice(self):
+        write_votes(self.states())
+        write_votes(self.states())
+        self.assertTally(self.question, 1, 1)
+        self.assertTally(self.answer, 0, 1)
+
+    def test_skips_deleted_targets(self):
+        states = {(self.voter.id, 'question', self.question.id + 100): Vote.LIKE,
+                  (self.voter.id, 'answer', self.answer.id): Vote.LIKE}
+        write_votes(states)
+        self.assertFalse(Vote.objects.filter(question__isnull=False).exists())
+        self.assertTally(self.answer, 1, 0)
+
+    def test_journal_replayed_twice(self):
+        # Журнал завершившегося процесса: последняя строка по каждому голосу определяет итог
+        lines = [
+            f'[{self.voter.id}, "question", {self.question.id}, 1]',
+            f'[{self.voter.id}, "question", {self.question.id}, -1]',
+            f'[{self.other.id}, "question", {self.question.id}, 1]',
+            f'[{self.voter.id}, "answer", {self.answer.id}, 1]',
+            f'[{self.voter.id}, "answer", {self.answer.id}, null]',
+            '[1, "question"',
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            for _ in range(2):
+                with open(os.path.join(directory, 'votes-999999-0.log'), 'w') as file:
+                    file.write('\n'.join(lines))
+                self.assertEqual(VoteJournal.replay(directory), 5)
+                self.assertEqual(os.listdir(directory), [])
+                self.assertTally(self.question, 1, 1)
+                self.assertTally(self.answer, 0, 0)
+
+
+# Буфер без фонового потока и журнала: запись вызывается в тесте явно
+@override_settings(VOTE_BUFFER_JOURNAL=None)
+@mock.patch.object(VoteBuffer, 'start')
+class VoteBufferTests(VoteTestMixin, TestCase):
+    def test_coalesced_toggles(self, start):
+        buffer = VoteBuffer()
+        self.assertEqual(buffer.add(self.voter, self.question, Vote.LIKE), 1)
+        self.assertEqual(buffer.add(self.voter, self.question, Vote.DISLIKE), -1)
+        self.assertEqual(buffer.add(self.other, self.question, Vote.LIKE), 0)
+        self.assertEqual(buffer.flush(), 2)
+        self.assertTally(self.question, 1, 1)
+
+    def test_projection_after_flush(self, start):
+        buffer = VoteBuffer()
+        # Объект загружен представлением до записи пакета с предыдущим голосом
+        stale = Question.objects.get(pk=self.question.pk)
+        self.assertEqual(buffer.add(self.voter, self.question, Vote.LIKE), 1)
+        buffer.flush()
+        self.assertEqual(buffer.add(self.other, stale, Vote.LIKE), 2)
+        buffer.flush()
+        self.assertTally(self.question, 2, 0)
+
+    def test_failed_flush_keeps_votes(self, start):
+        buffer = VoteBuffer()
+        buffer.add(self.voter, self.question, Vote.LIKE)
+        with mock.patch('app.vote_buffer.write_votes', side_effect=OperationalError('database is locked')):
+            with self.assertRaises(OperationalError):
+                buffer.flush()
+        self.assertEqual(buffer.add(self.other, self.question, Vote.LIKE), 2)
+        self.assertEqual(buffer.flush(), 2)
+        self.assertTally(self.question, 2, 0)
+
+
+class ReplayCommandTests(VoteTestMixin, TestCase):
+    def test_replay_votes(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(VOTE_BUFFER_JOURNAL=directory):
+            with open(os.path.join(directory, 'votes-999999-3.log'), 'w') as file:
+                file.write(f'[{self.voter.id}, "answer", {self.answer.id}, -1]\n')
+            with self.assertLogs('app.vote_buffer', 'WARNING'):
+                call_command('replay_votes', stdout=StringIO())
+            self.assertEqual(os.listdir(directory), [])
+        self.assertTally(self.answer, 0, 1)
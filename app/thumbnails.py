@@ -0,0 +1,60 @@
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+# Плотности экрана и форматы миниатюр аватаров: WebP и PNG для браузеров без WebP
+THUMBNAIL_SCALES = (1, 2)
+THUMBNAIL_FORMATS = {'webp': 'WEBP', 'png': 'PNG'}
+
+
+def thumbnail_name(name, scale, extension):
+    # Миниатюра хранится рядом с оригиналом: img/avatars/cat.jpg -> img/avatars/cat.jpg.thumb-2x.webp.
+    # Расширение оригинала остается в имени, иначе у cat.jpg и cat.png были бы общие миниатюры
+    return f'{name}.thumb-{scale}x.{extension}'
+
+
+def thumbnail_names(name):
+    return [thumbnail_name(name, scale, extension)
+            for scale in THUMBNAIL_SCALES for extension in THUMBNAIL_FORMATS]
+
+
+def thumbnails_exist(name, storage=default_storage):
+    return all(storage.exists(thumbnail) for thumbnail in thumbnail_names(name))
+
+
+def generate_thumbnails(name, storage=default_storage):
+    # Квадратные миниатюры AVATAR_THUMBNAIL_SIZE и вдвое больше с обрезкой по центру.
+    # Возвращает False, если файл не читается как изображение
+    try:
+        with storage.open(name) as file:
+            image = Image.open(file)
+            image = ImageOps.exif_transpose(image)
+            image.load()
+    except (OSError, Image.DecompressionBombError):
+        return False
+    image = image.convert('RGBA')
+
+    for scale in THUMBNAIL_SCALES:
+        size = settings.AVATAR_THUMBNAIL_SIZE * scale
+        thumbnail = ImageOps.fit(image, (size, size), Image.LANCZOS)
+        for extension, image_format in THUMBNAIL_FORMATS.items():
+            output = BytesIO()
+            if image_format == 'WEBP':
+                thumbnail.save(output, image_format, quality=settings.AVATAR_THUMBNAIL_QUALITY, method=6)
+            else:
+                thumbnail.save(output, image_format, optimize=True)
+            target = thumbnail_name(name, scale, extension)
+            # Хранилище не перезаписывает файлы, а добавляет к имени суффикс
+            if storage.exists(target):
+                storage.delete(target)
+            storage.save(target, ContentFile(output.getvalue()))
+    return True
+
+
+def thumbnail_urls(name, storage=default_storage):
+    # Адреса миниатюр для шаблона: webp_1x, webp_2x, png_1x, png_2x
+    return {f'{extension}_{scale}x': storage.url(thumbnail_name(name, scale, extension))
+            for scale in THUMBNAIL_SCALES for extension in THUMBNAIL_FORMATS}
@@ -1,16 +1,35 @@
 import json
+import time
+from functools import wraps
+from urllib.parse import urlencode
 
+from asgiref.sync import sync_to_async
 from django.contrib.auth.decorators import login_required
+from django.conf import settings as django_settings
+from django.contrib.auth.views import redirect_to_login
 from django.forms import model_to_dict
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect, reverse, get_object_or_404
+from django.template.loader import render_to_string
 from django.core.paginator import Paginator
 
 from django.contrib.auth import authenticate, login, logout
+from django.db import transaction
+from django.views.decorators.cache import cache_control
 from django.views.decorators.csrf import csrf_protect, ensure_csrf_cookie
+from django.views.decorators.http import condition
 
+from .context_processors import invalidate_sidebar
+from .events import publish_on_commit, question_events
 from .forms import ProfileEditorForm, LoginForm, RegisterForm, QuestionForm, AnswerForm
 from .models import Question, Profile, Tag, Answer, Vote
+from .pagination import paginate_feed
+from .search import get_search_backend
+from .stamps import feed_etag, question_etag, question_stamp, touch_on_commit
+from .tag_index import tag_index
+from .vote_buffer import cast_vote, cast_votes
+from .votes import MAX_BATCH_VOTES
 
 
 def paginate(objects, page_num, per_page=15):
@@ -18,58 +37,76 @@ def paginate(objects, page_num, per_page=15):
     return paginator.page(page_num)
 
 
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=feed_etag)
 def index(request):
-    top_users = Profile.objects.get_top_users()
-    popular_tags = Tag.get_popular_tags()
-
     page_name = f'Вопросы'
-    page = request.GET.get('page', 1)
-    paginated_questions = Question.paginate_questions(Question.objects.new_questions(), page)
+    paginated_questions = paginate_feed(Question.objects.new_questions(), request.GET, ['id'])
     return render(request, 'index.html', {'page_name': page_name,
-                                          'questions': paginated_questions,
-                                          'top_users': top_users,
-                                          'popular_tags': popular_tags})
+                                          'questions': paginated_questions})
 
 
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=feed_etag)
+def unanswered(request):
+    page_name = 'Вопросы без ответов'
+    paginated_questions = paginate_feed(Question.objects.unanswered_questions(), request.GET, ['id'])
+    return render(request, 'index.html', {'page_name': page_name,
+                                          'questions': paginated_questions})
+
+
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=feed_etag)
 def hottest(request):
     page_name = f'Самое популярное'
-    top_users = Profile.objects.get_top_users()
-    popular_tags = Tag.get_popular_tags()
-
-    page = request.GET.get('page', 1)
-    hot_questions = Question.objects.best_questions()
-    paginated_questions = Question.paginate_questions(hot_questions, page)
+    hot_questions = Question.objects.hot_questions()
+    paginated_questions = paginate_feed(hot_questions, request.GET, ['hot_score', 'id'])
     return render(request, 'index.html', {'page_name': page_name,
-                                          'questions': paginated_questions,
-                                          'top_users': top_users,
-                                          'popular_tags': popular_tags})
+                                          'questions': paginated_questions})
 
 
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=feed_etag)
 def tag_page(request, tag_name):
     page_name = f'Вопросы по тегу {tag_name}'
-    top_users = Profile.objects.get_top_users()
-    popular_tags = Tag.get_popular_tags()
-
     # Получаем объект тега по имени
-    tag = Tag.objects.get(name=tag_name)
+    tag = get_object_or_404(Tag, name=tag_name)
     # Получаем вопросы с этим тегом
-    questions_with_tag = Question.objects.filter(tags=tag)
-    page = request.GET.get('page', 1)
-    paginated_questions = Question.paginate_questions(questions_with_tag, page)
+    questions_with_tag = Question.objects.tagged_questions(tag)
+    paginated_questions = paginate_feed(questions_with_tag, request.GET, ['id'])
     return render(request, 'index.html', {'page_name': page_name,
-                                          'top_users': top_users,
-                                          'popular_tags': popular_tags,
                                           'questions': paginated_questions})
 
 
+def search(request):
+    query = request.GET.get('q', '').strip()
+    page_name = f'Результаты поиска: {query}'
+
+    question_ids = get_search_backend().search(query)
+    paginated_questions = Question.paginate_questions(question_ids, request.GET.get('page', 1))
+    # Загружаем только вопросы текущей страницы, сохраняя порядок релевантности
+    questions = Question.objects.list_questions().in_bulk(paginated_questions.object_list)
+    paginated_questions.object_list = [questions[question_id] for question_id in paginated_questions.object_list
+                                       if question_id in questions]
+    return render(request, 'index.html', {'page_name': page_name,
+                                          'questions': paginated_questions,
+                                          'query': query,
+                                          'extra_query': '&' + urlencode({'q': query})})
+
+
+def tag_autocomplete(request):
+    prefix = request.GET.get('q', '').strip().lower()
+    tags = tag_index.complete(prefix) if prefix else []
+    return JsonResponse({'tags': tags})
+
+
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=question_etag)
 @csrf_protect
 def question(request, question_id):
-    top_users = Profile.objects.get_top_users()
-    popular_tags = Tag.get_popular_tags()
-
-    item = Question.objects.get(id=question_id)
+    item = get_object_or_404(Question.objects.list_questions(), id=question_id)
     page = request.GET.get('page', 1)
-    paginated_answer = Question.paginate_questions(item.answer_set.all(), page, 5)
+    paginated_answer = Question.paginate_questions(item.get_answers(), page, 5)
 
     if request.method == 'POST':
         answer_form = AnswerForm(request.POST, user=request.user, item=item)
@@ -80,17 +117,92 @@ def question(request, question_id):
         answer_form = AnswerForm()
     return render(request, 'question.html', {'question': item,
                                              'answers': paginated_answer,
-                                             'top_users': top_users,
-                                             'popular_tags': popular_tags,
+                                             'is_question_author': is_question_author(request, item),
+                                             # Подписка на обновления страницы начинается с событий после отрисовки
+                                             'events_after': question_events.last_id,
+                                             'events_stream': isinstance(request, ASGIRequest),
+                                             'events_poll_interval': django_settings.EVENTS_POLL_INTERVAL,
                                              'form': answer_form})
 
 
+def is_question_author(request, item):
+    # Отметка правильного ответа доступна только автору вопроса
+    # Сравнение по пользователю: у пользователя без профиля (например, созданного createsuperuser) нет request.user.profile
+    return request.user.is_authenticated and item.author.user_id == request.user.id
+
+
+def parse_event_id(value):
+    # Номер последнего полученного клиентом события; без него отдаются только новые события.
+    # Номер больше последнего бывает после перезапуска сервера - тогда отдается вся история
+    try:
+        event_id = int(value)
+    except (TypeError, ValueError):
+        return question_events.last_id
+    return event_id if 0 <= event_id <= question_events.last_id else 0
+
+
+def event_payloads(request, item, events):
+    # Данные событий для клиента: новые ответы отрисовываются с учетом прав подписчика
+    payloads = []
+    answer_ids = [data['id'] for _, event_type, data in events if event_type == 'answer']
+    answers = Answer.objects.select_related('author').in_bulk(answer_ids) if answer_ids else {}
+    for event_id, event_type, data in events:
+        if event_type == 'answer':
+            answer = answers.get(data['id'])
+            if answer is None:
+                continue
+            data = dict(data, html=render_to_string('components/answer_item.html', {
+                'answer': answer,
+                'is_question_author': is_question_author(request, item),
+            }, request=request))
+        payloads.append({'id': event_id, 'type': event_type, 'data': data})
+    return payloads
+
+
+async def question_event_stream(request, item, after):
+    # Поток закрывается через EVENTS_STREAM_TIMEOUT секунд, EventSource переподключается с Last-Event-ID
+    deadline = time.monotonic() + django_settings.EVENTS_STREAM_TIMEOUT
+    while time.monotonic() < deadline:
+        events = await question_events.wait(item.id, after, django_settings.EVENTS_KEEPALIVE)
+        if not events:
+            # Комментарий SSE не дает прокси закрыть простаивающее соединение
+            yield ': keepalive\n\n'
+            continue
+        after = events[-1][0]
+        for payload in await sync_to_async(event_payloads)(request, item, events):
+            yield f'id: {payload["id"]}\nevent: {payload["type"]}\ndata: {json.dumps(payload["data"])}\n\n'
+
+
+async def question_stream(request, question_id):
+    # Server-sent events страницы вопроса: изменения рейтингов, отметки правильных и новые ответы.
+    # Обработчик WSGI собирает асинхронный поток целиком и отдал бы его только после закрытия,
+    # поэтому без ASGI поток не открывается (страница под WSGI его и не запрашивает), а на 204 EventSource
+    # не переподключается
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    item = await aget_object_or_404(Question.objects.select_related('author').only('author__user'), pk=question_id)
+    after = parse_event_id(request.headers.get('Last-Event-ID') or request.GET.get('after'))
+    response = StreamingHttpResponse(question_event_stream(request, item, after), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def question_poll(request, question_id):
+    # Long-poll для клиентов без потока SSE: ответ приходит с первыми событиями или по таймауту.
+    # Под WSGI представление выполняется в рабочем потоке, и ожидание заняло бы его на весь таймаут,
+    # поэтому там ответ отдается сразу, а клиент повторяет запрос через EVENTS_POLL_INTERVAL секунд
+    item = await aget_object_or_404(Question.objects.select_related('author').only('author__user'), pk=question_id)
+    after = parse_event_id(request.GET.get('after'))
+    timeout = django_settings.EVENTS_POLL_TIMEOUT if isinstance(request, ASGIRequest) else 0
+    events = await question_events.wait(item.id, after, timeout)
+    payloads = await sync_to_async(event_payloads)(request, item, events) if events else []
+    return JsonResponse({'events': payloads, 'last_id': events[-1][0] if events else after})
+
+
 @csrf_protect
 @login_required(login_url='login')
 def ask(request):
-    top_users = Profile.objects.get_top_users()
-    popular_tags = Tag.get_popular_tags()
-
     if request.method == 'POST':
         question_form = QuestionForm(request.POST, author=request.user.profile)
         if question_form.is_valid():
@@ -99,16 +211,11 @@ def ask(request):
                 return redirect('question', question_id=question_item.id)
     else:
         question_form = QuestionForm()
-    return render(request, 'ask.html', {'top_users': top_users,
-                                        'popular_tags': popular_tags,
-                                        'form': question_form})
+    return render(request, 'ask.html', {'form': question_form})
 
 
 @csrf_protect
 def login_view(request):
-    top_users = Profile.objects.get_top_users()
-    popular_tags = Tag.get_popular_tags()
-
     if request.method == 'POST':
         log_form = LoginForm(request.POST)
         if log_form.is_valid():
@@ -122,41 +229,37 @@ def login_view(request):
                 log_form.add_error('password', 'Неверный логин или пароль')
     else:
         log_form = LoginForm()
-    return render(request, 'login.html', {'top_users': top_users,
-                                          'popular_tags': popular_tags,
-                                          'form': log_form})
+    return render(request, 'login.html', {'form': log_form})
 
 
 @csrf_protect
 def signup(request):
-    top_users = Profile.objects.get_top_users()
-    popular_tags = Tag.get_popular_tags()
-
     if request.method == 'POST':
         reg_form = RegisterForm(request.POST)
         if reg_form.is_valid():
-            user = reg_form.save()
+            # Пользователь и профиль создаются вместе: без профиля учетная запись неработоспособна
+            with transaction.atomic():
+                user = reg_form.save()
+                if user:
+                    Profile.objects.create(user=user, nickname=reg_form.cleaned_data['username'])
             if user:
-                login(request, user)
-                Profile.objects.create(user=user, nickname=reg_form.cleaned_data['username'])
+                # При нескольких AUTHENTICATION_BACKENDS бэкенд нужно указать явно
+                login(request, user, backend='app.backends.CachedProfileBackend')
                 return redirect(reverse('index'))
             else:
                 reg_form.add_error(None, 'Ошибка регистрации. Попробуйте еще раз')
     else:
         reg_form = RegisterForm()
-    return render(request, 'signup.html', {'top_users': top_users,
-                                           'popular_tags': popular_tags,
-                                           'form': reg_form})
+    return render(request, 'signup.html', {'form': reg_form})
 
 
 @csrf_protect
 @login_required(login_url='login')
 def settings(request):
-    top_users = Profile.objects.get_top_users()
-    popular_tags = Tag.get_popular_tags()
-
-    user = request.user
-    profile = user.profile
+    # Профиль из базы, а не из кэша профилей: форма сохраняет все поля, и устаревшая копия
+    # затерла бы рейтинг и признак миниатюр, изменившиеся после ее загрузки
+    profile = get_object_or_404(Profile.objects.select_related('user'), user_id=request.user.id)
+    user = profile.user
 
     if request.method == 'POST':
         form = ProfileEditorForm(request.POST, request.FILES, instance=profile)
@@ -164,11 +267,9 @@ def settings(request):
             form.save()
             return redirect('settings')
     else:
-        form = ProfileEditorForm(instance=profile, initial=model_to_dict(request.user))
+        form = ProfileEditorForm(instance=profile, initial=model_to_dict(user))
 
-    return render(request, 'settings.html', {'top_users': top_users,
-                                             'popular_tags': popular_tags,
-                                             'form': form})
+    return render(request, 'settings.html', {'form': form})
 
 
 def logout_view(request):
@@ -183,73 +284,122 @@ def logout_view(request):
         return redirect(reverse('index'))
 
 
-@csrf_protect
-@login_required(login_url='login')
-def question_like(request):
-    question_id = request.POST.get('question_id')
-    like_type = request.POST.get('like_type')
+def get_request_profile(request):
+    # Профиль авторизованного пользователя или None
+    return request.user.profile if request.user.is_authenticated else None
 
-    question_item = get_object_or_404(Question, pk=question_id)
 
-    existing_vote = Vote.objects.filter(profile=request.user.profile, question=question_item).first()
+def async_login_required(view):
+    # login_required и csrf_protect в Django 4.2 не поддерживают асинхронные представления,
+    # CSRF-токен проверяет CsrfViewMiddleware
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        request.profile = await sync_to_async(get_request_profile)(request)
+        if request.profile is None:
+            return redirect_to_login(request.get_full_path(), 'login')
+        return await view(request, *args, **kwargs)
 
-    # Если голос существует и прожат тот же голос
-    if existing_vote and existing_vote.vote_type == like_type:
-        # Если голос уже существует, удаляем его
-        existing_vote.delete()
-    # Если голос существует, но прожат обратный голос
-    elif existing_vote:
-        # Меняем значение на противоположный
-        existing_vote.vote_type = like_type
-        existing_vote.save()
-    else:
-        Vote.objects.create(profile=request.user.profile, vote_type=like_type, question=question_item)
+    return wrapper
 
-    count = question_item.get_total_rating()
-    return JsonResponse({'count': count})
 
+async def aget_object_or_404(queryset, **kwargs):
+    try:
+        return await queryset.aget(**kwargs)
+    except queryset.model.DoesNotExist:
+        raise Http404
 
-@csrf_protect
-@login_required(login_url='login')
-def answer_like(request):
-    answer_id = request.POST.get('answer_id')
+
+@async_login_required
+async def question_like(request):
+    question_id = request.POST.get('question_id')
     like_type = request.POST.get('like_type')
 
-    answer_item = get_object_or_404(Answer, pk=answer_id)
+    question_item = await aget_object_or_404(Question.objects.all(), pk=question_id)
+    if like_type not in Vote.VOTE_VALUES:
+        return JsonResponse({'error': 'Неизвестный тип голоса'}, status=400)
+
+    count = await sync_to_async(cast_vote)(request.profile, question_item, Vote.VOTE_VALUES[like_type])
+    return JsonResponse({'count': count})
 
-    existing_vote = Vote.objects.filter(profile=request.user.profile, answer=answer_item).first()
 
-    # Если голос существует и прожат тот же голос
-    if existing_vote and existing_vote.vote_type == like_type:
-        # Если голос уже существует, удаляем его
-        existing_vote.delete()
-    # Если голос существует, но прожат обратный голос
-    elif existing_vote:
-        # Меняем значение на противоположный
-        existing_vote.vote_type = like_type
-        existing_vote.save()
-    else:
-        Vote.objects.create(profile=request.user.profile, vote_type=like_type, answer=answer_item)
+@async_login_required
+async def answer_like(request):
+    answer_id = request.POST.get('answer_id')
+    like_type = request.POST.get('like_type')
+
+    answer_item = await aget_object_or_404(Answer.objects.all(), pk=answer_id)
+    if like_type not in Vote.VOTE_VALUES:
+        return JsonResponse({'error': 'Неизвестный тип голоса'}, status=400)
 
-    count = answer_item.get_total_rating()
+    count = await sync_to_async(cast_vote)(request.profile, answer_item, Vote.VOTE_VALUES[like_type])
     return JsonResponse({'count': count})
 
 
-@csrf_protect
-@login_required(login_url='login')
-def make_correct(request):
+def parse_vote_batch(body):
+    # Разбор пакета {"votes": [{"type": "question", "id": 1, "like_type": "like"}, ...]}
+    # в список (модель, id, значение голоса); None, если пакет некорректен
+    try:
+        votes = json.loads(body)['votes']
+    except (ValueError, TypeError, KeyError):
+        return None
+    if not isinstance(votes, list) or not 0 < len(votes) <= MAX_BATCH_VOTES:
+        return None
+
+    models = {'question': Question, 'answer': Answer}
+    operations = []
+    for vote in votes:
+        if not isinstance(vote, dict):
+            return None
+        model = models.get(vote.get('type'))
+        item_id = vote.get('id')
+        value = Vote.VOTE_VALUES.get(vote.get('like_type'))
+        if model is None or value is None or not isinstance(item_id, int) or isinstance(item_id, bool):
+            return None
+        operations.append((model, item_id, value))
+    return operations
+
+
+@async_login_required
+async def votes_batch(request):
+    # Несколько голосов одним запросом: клиент накапливает нажатия и отправляет их вместе
+    operations = parse_vote_batch(request.body)
+    if operations is None:
+        return JsonResponse({'error': f'Ожидается список из не более чем {MAX_BATCH_VOTES} голосов'}, status=400)
+
+    items = {}
+    for model in (Question, Answer):
+        ids = {item_id for item_model, item_id, _ in operations if item_model is model}
+        if ids:
+            items[model] = await model.objects.ain_bulk(ids)
+    if any(item_id not in items[model] for model, item_id, _ in operations):
+        raise Http404
+
+    counts = await sync_to_async(cast_votes)(
+        request.profile, [(items[model][item_id], value) for model, item_id, value in operations]
+    )
+
+    # Итоговый рейтинг каждого объекта - после последней операции с ним
+    results = {}
+    for (model, item_id, _), count in zip(operations, counts):
+        results[(model._meta.model_name, item_id)] = count
+    return JsonResponse({'votes': [{'type': item_type, 'id': item_id, 'count': count}
+                                   for (item_type, item_id), count in results.items()]})
+
+
+def toggle_correct(answer_item):
+    if answer_item.toggle_correct():
+        invalidate_sidebar()
+        touch_on_commit(question_stamp(answer_item.question_id))
+        publish_on_commit(answer_item.question_id, 'correct', {'id': answer_item.id, 'correct': answer_item.correct})
+
+
+@async_login_required
+async def make_correct(request):
     answer_id = request.POST.get('answer_id')
 
-    answer_item = get_object_or_404(Answer, pk=answer_id)
-
-    profile = request.user.profile
+    answer_item = await aget_object_or_404(Answer.objects.select_related('question'), pk=answer_id)
 
-    if answer_item.question.author == profile:
-        if not answer_item.correct:
-            answer_item.correct = True
-        else:
-            answer_item.correct = False
-        answer_item.save()
+    if answer_item.question.author_id == request.profile.id:
+        await sync_to_async(toggle_correct)(answer_item)
 
     return JsonResponse({'correct': answer_item.correct})
-
@@ -0,0 +1,345 @@
+import atexit
+import glob
+import json
+import logging
+import os
+import re
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, close_old_connections, transaction
+
+from .models import Answer, Profile, Question, Vote
+from .votes import apply_vote, apply_votes, update_counters
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Оцениваемые модели по имени, под которым они записываются в ключ голоса и журнал
+VOTE_MODELS = {'question': Question, 'answer': Answer}
+
+SEGMENT_PATTERN = re.compile(r'votes-(\d+)-(\d+)\.log$')
+
+
+def add_delta(deltas, key, delta):
+    total = deltas.setdefault(key, {'likes': 0, 'dislikes': 0})
+    total['likes'] += delta['likes']
+    total['dislikes'] += delta['dislikes']
+
+
+def write_votes(states):
+    # Запись итоговых состояний голосов {(profile_id, модель, item_id): значение или None} одной транзакцией:
+    # голоса сравниваются с сохраненными, изменения записываются пакетами, счетчики каждого объекта
+    # меняются один раз. Повторная запись тех же состояний ничего не меняет, поэтому журнал можно
+    # воспроизводить после сбоя, не зная, какая часть уже записана
+    with transaction.atomic():
+        profile_ids = set(Profile.objects.filter(id__in={key[0] for key in states}).values_list('id', flat=True))
+        for model_name, model in VOTE_MODELS.items():
+            keys = [key for key in states if key[1] == model_name and key[0] in profile_ids]
+            # Объекты, удаленные до записи, пропускаются вместе с голосами за них
+            items = model.objects.in_bulk({item_id for _, _, item_id in keys})
+            keys = [key for key in keys if key[2] in items]
+            if not keys:
+                continue
+
+            target = f'{model_name}_id'
+            existing = {(vote.profile_id, getattr(vote, target)): vote for vote in Vote.objects.filter(
+                profile_id__in={profile_id for profile_id, _, _ in keys},
+                **{f'{target}__in': {item_id for _, _, item_id in keys}},
+            )}
+            created, deleted, updated = [], [], {Vote.LIKE: [], Vote.DISLIKE: []}
+            deltas = {}
+            for profile_id, _, item_id in keys:
+                value = states[(profile_id, model_name, item_id)]
+                vote = existing.get((profile_id, item_id))
+                old_value = vote.value if vote is not None else None
+                if old_value == value:
+                    continue
+                if vote is None:
+                    created.append(Vote(profile_id=profile_id, value=value, **{target: item_id}))
+                elif value is None:
+                    deleted.append(vote.id)
+                else:
+                    updated[value].append(vote.id)
+                add_delta(deltas, item_id, Vote.counters_delta(old_value, value))
+
+            Vote.objects.bulk_create(created)
+            if deleted:
+                Vote.objects.filter(id__in=deleted).delete()
+            for value, ids in updated.items():
+                if ids:
+                    Vote.objects.filter(id__in=ids).update(value=value)
+            for item_id, delta in deltas.items():
+                update_counters(items[item_id], delta)
+
+
+class VoteJournal:
+    # Журнал операций буфера в каталоге VOTE_BUFFER_JOURNAL: файлы votes-<pid>-<номер>.log,
+    # строка JSON [profile_id, модель, item_id, значение] на операцию. При сбросе буфера начинается
+    # новый файл, а записанные файлы удаляются. Процесс держит flock на своем votes-<pid>.lock:
+    # журналы процесса, чья блокировка свободна (процесс завершился, в том числе аварийно),
+    # воспроизводит следующий запустившийся процесс
+
+    def __init__(self, directory):
+        if fcntl is None:
+            raise ImproperlyConfigured('VOTE_BUFFER_JOURNAL требует fcntl (Unix)')
+        self.directory = directory
+        self.pid = os.getpid()
+        os.makedirs(directory, exist_ok=True)
+        self._lock_file = open(self.path(f'votes-{self.pid}.lock'), 'w')
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        self.sequence = 0
+        self._file = open(self.segment_path(self.sequence), 'a')
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def segment_path(self, sequence):
+        return self.path(f'votes-{self.pid}-{sequence}.log')
+
+    def append(self, key, value):
+        self._file.write(json.dumps([*key, value]) + '\n')
+        self._file.flush()
+        # Без fsync операция переживает падение процесса, но не отключение питания
+        if settings.VOTE_BUFFER_FSYNC:
+            os.fsync(self._file.fileno())
+
+    def rotate(self):
+        # Новый файл для следующих операций; возвращает номер, меньше которого файлы закрыты
+        self._file.close()
+        self.sequence += 1
+        self._file = open(self.segment_path(self.sequence), 'a')
+        return self.sequence
+
+    def remove_closed(self, sequence):
+        for path in glob.glob(self.path(f'votes-{self.pid}-*.log')):
+            if int(SEGMENT_PATTERN.search(path).group(2)) < sequence:
+                os.remove(path)
+
+    def close(self):
+        self._file.close()
+        if os.path.getsize(self.segment_path(self.sequence)) == 0:
+            os.remove(self.segment_path(self.sequence))
+        os.remove(self._lock_file.name)
+        self._lock_file.close()
+
+    @staticmethod
+    def replay(directory):
+        # Запись голосов из журналов завершившихся процессов; возвращает количество операций
+        if not os.path.isdir(directory):
+            return 0
+        segments = {}
+        for path in glob.glob(os.path.join(directory, 'votes-*-*.log')):
+            match = SEGMENT_PATTERN.search(path)
+            segments.setdefault(match.group(1), []).append((int(match.group(2)), path))
+
+        replayed = 0
+        for pid, files in segments.items():
+            lock_path = os.path.join(directory, f'votes-{pid}.lock')
+            with open(lock_path, 'a') as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Процесс жив или его журнал уже воспроизводит другой процесс
+                    continue
+                # Последнее состояние каждого голоса в порядке записи
+                states = {}
+                for _, path in sorted(files):
+                    with open(path) as file:
+                        for line in file:
+                            try:
+                                profile_id, model_name, item_id, value = json.loads(line)
+                            except ValueError:
+                                # Строка, недописанная при сбое
+                                continue
+                            states[(profile_id, model_name, item_id)] = value
+                            replayed += 1
+                write_votes(states)
+                for _, path in files:
+                    os.remove(path)
+                os.remove(lock_path)
+        return replayed
+
+
+class VoteBuffer:
+    # Отложенная запись голосов (VOTE_WRITE_BEHIND): голос сразу применяется к буферу в памяти процесса,
+    # а клиент получает рейтинг с учетом еще не записанных голосов. Буфер хранит только итоговое
+    # значение голоса каждого пользователя за каждый объект, поэтому повторные нажатия схлопываются.
+    # Фоновый поток записывает буфер одной транзакцией раз в VOTE_BUFFER_FLUSH_MS миллисекунд
+    # или после VOTE_BUFFER_MAX_OPERATIONS операций. Операции пишутся в журнал VoteJournal,
+    # если задан VOTE_BUFFER_JOURNAL, и незаписанные голоса завершившегося процесса не теряются
+
+    def __init__(self):
+        # (profile_id, модель, item_id) -> значение голоса или None, если голос снят
+        self._pending = {}
+        # Состояния, которые сейчас записываются фоновым потоком
+        self._flushing = {}
+        # Изменения счетчиков (модель, item_id) -> {'likes', 'dislikes'} по незаписанным голосам
+        self._pending_deltas = {}
+        self._flushing_deltas = {}
+        self._operations = 0
+        self._journal = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # Пока пакет записывается, часть его голосов может быть уже в базе, а часть еще нет:
+        # голосующие ждут окончания записи, а номер поколения меняется в начале и в конце каждой записи
+        self._writing = False
+        self._generation = 0
+        self._written = threading.Condition(self._lock)
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+
+    def start(self):
+        # Воспроизведение журналов завершившихся процессов и запуск фонового потока при первом голосе
+        with self._lock:
+            if self._thread is not None:
+                return
+            if settings.VOTE_BUFFER_JOURNAL:
+                replay_journal()
+                self._journal = VoteJournal(settings.VOTE_BUFFER_JOURNAL)
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='vote-buffer', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def add(self, profile, item, value):
+        # Переключение голоса как в apply_vote; возвращает ожидаемый рейтинг объекта
+        self.start()
+        model_name = item._meta.model_name
+        key = (profile.id, model_name, item.id)
+        while True:
+            with self._lock:
+                while self._writing:
+                    self._written.wait()
+                generation = self._generation
+                buffered = key in self._pending
+            # Запросы к базе выполняются без блокировки, чтобы голосующие не ждали друг друга.
+            # Если за это время началась запись пакета, прочитанное могло устареть - чтение повторяется
+            rating = type(item).objects.filter(pk=item.pk).values_list('rating', flat=True).first()
+            stored_value = None if buffered else self._stored_value(key)
+            with self._lock:
+                if self._generation != generation:
+                    continue
+                old_value = self._pending[key] if key in self._pending else stored_value
+                new_value = None if old_value == value else value
+                self._pending[key] = new_value
+                add_delta(self._pending_deltas, (model_name, item.id), Vote.counters_delta(old_value, new_value))
+                if self._journal is not None:
+                    self._journal.append(key, new_value)
+                self._operations += 1
+                full = self._operations >= settings.VOTE_BUFFER_MAX_OPERATIONS
+                # Рейтинг в базе и незаписанные изменения прочитаны между записями пакетов
+                delta = self._pending_deltas[(model_name, item.id)]
+                rating = (item.rating if rating is None else rating) + delta['likes'] - delta['dislikes']
+            if full:
+                self._wakeup.set()
+            return rating
+
+    @staticmethod
+    def _stored_value(key):
+        profile_id, model_name, item_id = key
+        return Vote.objects.filter(profile_id=profile_id, **{f'{model_name}_id': item_id}) \
+            .values_list('value', flat=True).first()
+
+    def flush(self):
+        # Запись накопленных голосов; возвращает количество записанных состояний
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                self._flushing, self._pending = self._pending, {}
+                self._flushing_deltas, self._pending_deltas = self._pending_deltas, {}
+                self._operations = 0
+                self._writing = True
+                self._generation += 1
+                sequence = self._journal.rotate() if self._journal is not None else None
+            failed = True
+            try:
+                write_votes(self._flushing)
+                failed = False
+            finally:
+                with self._lock:
+                    if failed:
+                        # Голоса возвращаются в буфер (более новые значения остаются), файлы журнала - на месте
+                        for key, value in self._flushing.items():
+                            self._pending.setdefault(key, value)
+                        for key, delta in self._flushing_deltas.items():
+                            add_delta(self._pending_deltas, key, delta)
+                    written = len(self._flushing)
+                    self._flushing, self._flushing_deltas = {}, {}
+                    self._writing = False
+                    self._generation += 1
+                    self._written.notify_all()
+            if sequence is not None:
+                self._journal.remove_closed(sequence)
+            return written
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(settings.VOTE_BUFFER_FLUSH_MS / 1000)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Vote buffer flush failed, retrying later')
+            finally:
+                close_old_connections()
+
+    def stop(self):
+        # Остановка фонового потока с записью оставшихся голосов (при завершении процесса и в тестах)
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._stopping.set()
+        self._wakeup.set()
+        thread.join()
+        self.flush()
+        with self._lock:
+            if self._journal is not None and not self._pending:
+                self._journal.close()
+            self._journal = None
+        atexit.unregister(self.stop)
+
+
+vote_buffer = VoteBuffer()
+
+
+def replay_journal():
+    # Запись голосов из журналов завершившихся процессов независимо от VOTE_WRITE_BEHIND:
+    # при запуске сервера (wsgi.py, asgi.py), командой replay_votes и перед первым голосом через буфер
+    if not settings.VOTE_BUFFER_JOURNAL:
+        return 0
+    if fcntl is None:
+        raise ImproperlyConfigured('VOTE_BUFFER_JOURNAL требует fcntl (Unix)')
+    replayed = VoteJournal.replay(settings.VOTE_BUFFER_JOURNAL)
+    if replayed:
+        logger.warning('Replayed %d buffered vote operations from journal', replayed)
+    return replayed
+
+
+def replay_journal_on_startup():
+    # Ошибка базы при запуске не мешает серверу стартовать: журнал остается и воспроизводится позже
+    try:
+        replay_journal()
+    except DatabaseError:
+        logger.exception('Failed to replay vote journal')
+
+
+def cast_vote(profile, item, value):
+    # Голос с записью сразу или через буфер в зависимости от VOTE_WRITE_BEHIND; возвращает рейтинг объекта
+    if settings.VOTE_WRITE_BEHIND:
+        return vote_buffer.add(profile, item, value)
+    return apply_vote(profile, item, value)
+
+
+def cast_votes(profile, operations):
+    if settings.VOTE_WRITE_BEHIND:
+        return [vote_buffer.add(profile, item, value) for item, value in operations]
+    return apply_votes(profile, operations)
@@ -0,0 +1,68 @@
+from django.db import IntegrityError, transaction
+
+from .events import publish_on_commit
+from .models import Question, Vote
+from .stamps import FEED_STAMP, question_stamp, touch_on_commit
+
+# Количество повторов при одновременном создании голоса тем же пользователем
+MAX_VOTE_ATTEMPTS = 3
+
+# Наибольшее количество операций в одном пакете голосов
+MAX_BATCH_VOTES = 50
+
+
+def vote_target(item):
+    # Поле голоса, ссылающееся на оцениваемый объект
+    return {'question': item} if isinstance(item, Question) else {'answer': item}
+
+
+def apply_vote(profile, item, value):
+    # Переключение голоса пользователя (value = Vote.LIKE или Vote.DISLIKE) за вопрос или ответ
+    # и изменение счетчиков в одной транзакции.
+    # Повторное нажатие того же голоса снимает его, нажатие обратного - меняет тип голоса.
+    # Транзакция начинается с UPDATE, поэтому в SQLite сразу берется блокировка на запись
+    # и чтение-изменение-запись не пересекается с другими голосами; уникальность
+    # (profile, question) и (profile, answer) защищает от дублей в остальных базах.
+    votes = Vote.objects.filter(profile=profile, **vote_target(item))
+    with transaction.atomic():
+        for attempt in range(MAX_VOTE_ATTEMPTS):
+            if votes.filter(value=-value).update(value=value):
+                delta = Vote.counters_delta(-value, value)
+            elif votes.filter(value=value).delete()[0]:
+                delta = Vote.counters_delta(value, None)
+            else:
+                try:
+                    with transaction.atomic():
+                        Vote.objects.create(profile=profile, value=value, **vote_target(item))
+                except IntegrityError:
+                    # Голос успели создать параллельным запросом - повторяем с учетом него
+                    if attempt == MAX_VOTE_ATTEMPTS - 1:
+                        raise
+                    continue
+                delta = Vote.counters_delta(None, value)
+            break
+
+        update_counters(item, delta)
+    return item.rating
+
+
+def update_counters(item, delta):
+    # Изменение счетчиков и рейтинга объекта на delta, пересчет оценки вопроса, событие и отметки страниц
+    # после фиксации транзакции. Вызывается внутри транзакции
+    item.update_rating(**delta)
+    if isinstance(item, Question):
+        item.update_hot_score()
+    question_id = item.id if isinstance(item, Question) else item.question_id
+    publish_on_commit(question_id, 'rating', {'type': item._meta.model_name, 'id': item.id, 'rating': item.rating})
+    # Рейтинг вопроса выводится и в лентах, рейтинг ответа - только на странице вопроса
+    if isinstance(item, Question):
+        touch_on_commit(question_stamp(question_id), FEED_STAMP)
+    else:
+        touch_on_commit(question_stamp(question_id))
+
+
+def apply_votes(profile, operations):
+    # Пакет голосов [(item, value), ...] применяется в одной транзакции в порядке следования,
+    # результат - рейтинг объекта после каждой операции
+    with transaction.atomic():
+        return [apply_vote(profile, item, value) for item, value in operations]
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'askme_novikov.settings')
 
 application = get_asgi_application()
+
+# Голоса из журнала буфера, не записанные завершившимся (в том числе аварийно) процессом
+from app.vote_buffer import replay_journal_on_startup  # noqa: E402
+
+replay_journal_on_startup()
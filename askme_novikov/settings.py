@@ -42,7 +42,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Первым, чтобы учитывать время всех остальных обработчиков
+    'app.performance.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'app.staticfiles.StaticFilesMiddleware',
+    # До сессий, чтобы чтение и запись сессии тоже проходили через маршрутизатор баз
+    'app.routers.DatabaseRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -55,7 +60,8 @@ ROOT_URLCONF = 'askme_novikov.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Стандартный бэкенд с учетом времени отрисовки в метриках запроса
+        'BACKEND': 'app.performance.DjangoTemplates',
         'DIRS': [
             BASE_DIR / 'templates'
         ],
@@ -66,6 +72,8 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'app.context_processors.sidebar',
+                'app.context_processors.fragment_cache',
             ],
         },
     },
@@ -81,9 +89,139 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Соединение живет между запросами, перед повторным использованием проверяется
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Настройки каждого нового соединения SQLite (app.sqlite): WAL позволяет читать во время записи,
+# synchronous=NORMAL в режиме WAL не теряет целостность при сбое процесса, cache_size в КиБ (отрицательное
+# значение), mmap_size в байтах, busy_timeout - сколько миллисекунд ждать блокировку записи вместо ошибки
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,
+    'mmap_size': 268435456,
+    'busy_timeout': 5000,
+    'temp_store': 'MEMORY',
+}
+
+# Запись идет в default, чтение в запросах - в реплики из DATABASE_REPLICAS (псевдонимы DATABASES).
+# Для локальной проверки в DATABASES добавляется, например,
+# 'replica': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'replica.sqlite3', 'TEST': {'MIRROR': 'default'}},
+# ее псевдоним - в DATABASE_REPLICAS, а копия данных обновляется командой sync_replicas
+DATABASE_ROUTERS = ['app.routers.PrimaryReplicaRouter']
+DATABASE_REPLICAS = []
+
+# После записи пользователь читает из основной базы DATABASE_PIN_SECONDS секунд (ожидаемое отставание реплик)
+DATABASE_PIN_COOKIE = 'primary_pin'
+DATABASE_PIN_SECONDS = 5
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Отрисованные карточки вопросов и ответов; ключи версионированы, устаревшие записи вытесняются
+    'fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'fragments',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
+# Отложенная запись голосов (app.vote_buffer): голоса копятся в памяти процесса и записываются пакетом
+# раз в VOTE_BUFFER_FLUSH_MS миллисекунд или после VOTE_BUFFER_MAX_OPERATIONS операций
+VOTE_WRITE_BEHIND = False
+VOTE_BUFFER_FLUSH_MS = 200
+VOTE_BUFFER_MAX_OPERATIONS = 500
+# Каталог журнала незаписанных голосов для воспроизведения после сбоя (None - без журнала)
+# и fsync каждой операции, чтобы журнал пережил и отключение питания
+VOTE_BUFFER_JOURNAL = BASE_DIR / 'vote_journal'
+VOTE_BUFFER_FSYNC = False
+
+# Сессии читаются из кэша, в базу только записываются и читаются при промахе кэша
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# Пользователь сессии берется из кэша профилей (app.profile_cache); ModelBackend оставлен
+# для сессий, созданных до его подключения
+AUTHENTICATION_BACKENDS = [
+    'app.backends.CachedProfileBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+# Размер кэша профилей в памяти процесса и время, через которое запись перечитывается из базы, в секундах
+PROFILE_CACHE_SIZE = 1000
+PROFILE_CACHE_TIMEOUT = 60
+
+# Время жизни данных боковой панели (лучшие пользователи и популярные теги), в секундах
+SIDEBAR_CACHE_TIMEOUT = 60
+
+# Время жизни отрисованной карточки вопроса или ответа, в секундах
+FRAGMENT_CACHE_TIMEOUT = 3600
+
+
+# Курсорная пагинация лент вопросов (?after=<токен>) вместо постраничной (?page=<номер>)
+CURSOR_PAGINATION = False
+
+
+# Ранжирование горячих вопросов: период (в секундах), за который вес активности падает в 10 раз,
+# и вес одного ответа относительно одного голоса
+HOT_DECAY_SECONDS = 45000
+HOT_ANSWER_WEIGHT = 2
+
+
+# Поисковый бэкенд: SqliteSearchBackend использует индекс FTS5, SimpleSearchBackend - запросы LIKE
+SEARCH_BACKEND = 'app.search.SqliteSearchBackend'
+
+
+# Период полной перезагрузки индекса автодополнения тегов, в секундах
+TAG_INDEX_TIMEOUT = 300
+
+
+# События страниц вопросов (SSE и long-poll): сколько последних событий хранится на вопрос и для скольких
+# вопросов, интервал комментариев-пингов в потоке, длительность одного потока и ожидания long-poll, в секундах.
+# Под WSGI ожидание заняло бы рабочий поток, поэтому там клиент опрашивает сервер раз в EVENTS_POLL_INTERVAL секунд
+EVENTS_HISTORY = 100
+EVENTS_QUESTIONS = 1000
+EVENTS_KEEPALIVE = 15
+EVENTS_STREAM_TIMEOUT = 300
+EVENTS_POLL_TIMEOUT = 25
+EVENTS_POLL_INTERVAL = 10
+
+
+# Метрики запросов (PerformanceMiddleware): порог медленного запроса в миллисекундах, сколько самых
+# долгих SQL-запросов писать в журнал и период сохранения счетчиков в базу, в секундах
+PERFORMANCE_SLOW_REQUEST_MS = 500
+PERFORMANCE_SLOW_QUERIES = 5
+PERFORMANCE_FLUSH_SECONDS = 10
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'app.performance': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+        'app.vote_buffer': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -121,6 +259,22 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Сюда collectstatic собирает файлы с хэшем содержимого в имени, сокращенные и заранее сжатые (gzip, brotli);
+# их отдает app.staticfiles.StaticFilesMiddleware
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'app.staticfiles.CompressedManifestStaticFilesStorage',
+    },
+}
+
+# Время кэширования статических файлов без хэша в имени, в секундах
+STATIC_CACHE_MAX_AGE = 60
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -132,3 +286,8 @@ STATICFILES_DIRS = [
 
 MEDIA_ROOT = BASE_DIR / 'uploads'
 MEDIA_URL = '/uploads/'
+
+# Сторона квадратной миниатюры аватара в CSS-пикселях (для экранов высокой плотности создается вдвое больше)
+# и качество сжатия WebP
+AVATAR_THUMBNAIL_SIZE = 125
+AVATAR_THUMBNAIL_QUALITY = 80
@@ -23,15 +23,21 @@ from app import views
 urlpatterns = [
     path('', views.index, name='index'),
     path('question/<int:question_id>', views.question, name='question'),
+    path('question/<int:question_id>/events', views.question_stream, name='question_stream'),
+    path('question/<int:question_id>/poll', views.question_poll, name='question_poll'),
     path('ask', views.ask, name='ask'),
     path('login', views.login_view, name='login'),
     path('logout', views.logout_view, name='logout'),
     path('signup', views.signup, name='signup'),
     path('profile/settings', views.settings, name='settings'),
     path('tag_page/<str:tag_name>', views.tag_page, name='tag_page'),
+    path('tags/autocomplete', views.tag_autocomplete, name='tag_autocomplete'),
     path('hottest', views.hottest, name='hottest'),
+    path('unanswered', views.unanswered, name='unanswered'),
+    path('search', views.search, name='search'),
     path('question_like/', views.question_like, name='question_like'),
     path('answer_like/', views.answer_like, name='answer_like'),
+    path('votes/batch/', views.votes_batch, name='votes_batch'),
     path('make_correct/', views.make_correct, name='make_correct'),
     path('admin/', admin.site.urls),
 ]
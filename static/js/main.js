@@ -13,15 +13,59 @@ function getCookie(name) {
     return cookieValue;
 }
 
-function handleLikeClick(itemId, itemType, likeType) {
-    const formData = new FormData();
-    formData.append(`${itemType}_id`, itemId);
-    formData.append('like_type', likeType);
+// Нажатия на голоса накапливаются и уходят одним запросом после паузы
+const VOTE_BATCH_DELAY = 300;
+const VOTE_BATCH_LIMIT = 50;
+
+// Ожидающие отправки голоса по объектам: ключ "тип:id" -> {itemType, itemId, counter, likeTypes}
+let pendingVotes = new Map();
+let pendingVotesCount = 0;
+let votesTimer = null;
+
+function queueVote(counter, itemType, likeType) {
+    const itemId = Number(counter.dataset.id);
+    const key = `${itemType}:${itemId}`;
+    if (!pendingVotes.has(key))
+        pendingVotes.set(key, {itemType, itemId, counter, likeTypes: []});
+    const likeTypes = pendingVotes.get(key).likeTypes;
+
+    // Голос переключается, поэтому три одинаковых нажатия подряд равносильны одному
+    const length = likeTypes.length;
+    if (length >= 2 && likeTypes[length - 1] === likeType && likeTypes[length - 2] === likeType) {
+        likeTypes.pop();
+        pendingVotesCount--;
+    } else {
+        likeTypes.push(likeType);
+        pendingVotesCount++;
+    }
+
+    clearTimeout(votesTimer);
+    if (pendingVotesCount >= VOTE_BATCH_LIMIT)
+        sendVotes();
+    else
+        votesTimer = setTimeout(sendVotes, VOTE_BATCH_DELAY);
+}
 
-    const request = new Request(`/${itemType}_like/`, {
+function sendVotes() {
+    clearTimeout(votesTimer);
+    const batch = pendingVotes;
+    pendingVotes = new Map();
+    pendingVotesCount = 0;
+
+    const votes = [];
+    for (let {itemType, itemId, likeTypes} of batch.values())
+        for (let likeType of likeTypes)
+            votes.push({type: itemType, id: itemId, like_type: likeType});
+    if (votes.length === 0)
+        return;
+
+    const request = new Request('/votes/batch/', {
         method: 'POST',
-        body: formData,
+        body: JSON.stringify({votes}),
+        // keepalive позволяет запросу завершиться после закрытия страницы
+        keepalive: true,
         headers: {
+            'Content-Type': 'application/json',
             'X-CSRFToken': getCookie('csrftoken'),
         }
     });
@@ -29,20 +73,26 @@ function handleLikeClick(itemId, itemType, likeType) {
     fetch(request)
         .then((response) => response.json())
         .then((data) => {
-            const counter = document.querySelector(`[data-id="${itemId}"]`);
-            counter.innerHTML = data.count;
+            for (let vote of data.votes) {
+                const pending = batch.get(`${vote.type}:${vote.id}`);
+                if (pending)
+                    pending.counter.innerHTML = vote.count;
+            }
         })
         .catch((error) => {
             console.error('Error:', error);
         });
 }
 
+// Несохраненные голоса отправляются при уходе со страницы
+window.addEventListener('pagehide', sendVotes);
+
 function attachLikeHandlers(items, itemType) {
     for (let item of items) {
         const [like, counter, dislike] = item.children;
 
-        like.addEventListener('click', () => handleLikeClick(counter.dataset.id, itemType, 'like'));
-        dislike.addEventListener('click', () => handleLikeClick(counter.dataset.id, itemType, 'dislike'));
+        like.addEventListener('click', () => queueVote(counter, itemType, 'like'));
+        dislike.addEventListener('click', () => queueVote(counter, itemType, 'dislike'));
     }
 }
 
@@ -83,12 +133,155 @@ function makeCorrect(itemId) {
         });
 }
 
-const correctButtons = document.getElementsByClassName('correct-answer');
+function attachCorrectHandlers(items) {
+    for (let item of items) {
+        // Флажок есть только у автора вопроса и у отмеченных ответов
+        const button = item.children[0];
+        if (button)
+            button.addEventListener('click', () => makeCorrect(item.dataset.id));
+    }
+}
+
+attachCorrectHandlers(document.getElementsByClassName('correct-answer'));
+
+
+// Обновления страницы вопроса: голоса, отметки правильных и новые ответы других пользователей
+const answersBlock = document.getElementById('answers');
+
+function applyQuestionEvent(eventType, data) {
+    if (eventType === 'rating') {
+        const counter = document.querySelector(`.${data.type}-reputation .votes[data-id="${data.id}"]`);
+        if (counter)
+            counter.innerHTML = data.rating;
+    } else if (eventType === 'correct') {
+        const checkbox = document.querySelector(`.correct-answer[data-id="${data.id}"] .form-check-input`);
+        const label = document.querySelector(`.correct-answer[data-id="${data.id}"] .form-check-label`);
+        if (checkbox)
+            checkbox.checked = data.correct;
+        if (label)
+            label.innerHTML = data.correct ? "Правильный ответ." : "Отметить как правильный.";
+    } else if (eventType === 'answer') {
+        if (answersBlock.dataset.append !== '1' || document.querySelector(`.correct-answer[data-id="${data.id}"]`))
+            return;
+        const template = document.createElement('template');
+        template.innerHTML = data.html.trim();
+        const answer = template.content.firstElementChild;
+        answersBlock.appendChild(answer);
+        attachLikeHandlers(answer.getElementsByClassName('answer-reputation'), 'answer');
+        attachCorrectHandlers(answer.getElementsByClassName('correct-answer'));
+    }
+}
+
+function pollQuestionEvents(questionId, after, delay) {
+    // Long-poll (delay 0): следующий запрос уходит сразу после ответа. Под WSGI сервер отвечает не дожидаясь
+    // событий, и запросы идут раз в delay миллисекунд. После ошибки - пауза не меньше 5 секунд
+    fetch(`/question/${questionId}/poll?after=${after}`)
+        .then((response) => response.json())
+        .then((data) => {
+            for (let event of data.events)
+                applyQuestionEvent(event.type, event.data);
+            setTimeout(() => pollQuestionEvents(questionId, data.last_id, delay), delay);
+        })
+        .catch((error) => {
+            console.error('Error:', error);
+            setTimeout(() => pollQuestionEvents(questionId, after, delay), Math.max(delay, 5000));
+        });
+}
+
+function subscribeQuestionEvents(questionId, after) {
+    if (!window.EventSource) {
+        pollQuestionEvents(questionId, after, 0);
+        return;
+    }
+
+    const source = new EventSource(`/question/${questionId}/events?after=${after}`);
+    let opened = false;
+    let lastId = after;
 
-for (let item of correctButtons) {
-    const button = item.children[0];
+    // Поток не открылся (прокси не пропускает потоковые ответы или сервер не отвечает) - переход на long-poll
+    function fallback() {
+        if (opened)
+            return;
+        opened = true;
+        clearTimeout(openTimer);
+        source.close();
+        pollQuestionEvents(questionId, lastId, 0);
+    }
+
+    const openTimer = setTimeout(fallback, 5000);
+
+    source.addEventListener('open', () => {
+        opened = true;
+        clearTimeout(openTimer);
+    });
+    for (let eventType of ['rating', 'correct', 'answer']) {
+        source.addEventListener(eventType, (event) => {
+            lastId = event.lastEventId;
+            applyQuestionEvent(eventType, JSON.parse(event.data));
+        });
+    }
+    source.addEventListener('error', fallback);
+}
 
-    button.addEventListener('click', () => makeCorrect(item.dataset.id));
+if (answersBlock) {
+    if (answersBlock.dataset.eventsStream === '1')
+        subscribeQuestionEvents(answersBlock.dataset.questionId, answersBlock.dataset.eventsAfter);
+    else
+        pollQuestionEvents(answersBlock.dataset.questionId, answersBlock.dataset.eventsAfter,
+                           answersBlock.dataset.pollInterval * 1000);
 }
 
 
+
+// Автодополнение тегов в форме вопроса
+const tagsInput = document.getElementById('id_tags');
+
+if (tagsInput) {
+    const tagsList = document.createElement('datalist');
+    tagsList.id = 'tags-autocomplete';
+    tagsInput.after(tagsList);
+    tagsInput.setAttribute('list', tagsList.id);
+    tagsInput.setAttribute('autocomplete', 'off');
+
+    // Ответы сервера кэшируются по префиксу, запрос уходит после паузы в наборе
+    const completions = new Map();
+    let timer = null;
+
+    function showCompletions(head, tags) {
+        tagsList.innerHTML = '';
+        for (let tag of tags) {
+            const option = document.createElement('option');
+            option.value = head + tag;
+            tagsList.appendChild(option);
+        }
+    }
+
+    tagsInput.addEventListener('input', () => {
+        clearTimeout(timer);
+        const value = tagsInput.value;
+        const separator = value.lastIndexOf(',');
+        const head = separator === -1 ? '' : value.substring(0, separator + 1) + ' ';
+        const prefix = value.substring(separator + 1).trim().toLowerCase();
+
+        if (!prefix) {
+            showCompletions(head, []);
+            return;
+        }
+        if (completions.has(prefix)) {
+            showCompletions(head, completions.get(prefix));
+            return;
+        }
+
+        timer = setTimeout(() => {
+            fetch(`/tags/autocomplete?q=${encodeURIComponent(prefix)}`)
+                .then((response) => response.json())
+                .then((data) => {
+                    completions.set(prefix, data.tags);
+                    showCompletions(head, data.tags);
+                })
+                .catch((error) => {
+                    console.error('Error:', error);
+                });
+        }, 200);
+    });
+}